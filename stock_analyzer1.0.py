@@ -1,24 +1,44 @@
 """Stock Market Data Analyzer"""
 
-from datetime import datetime
+from datetime import date, datetime
+import io
+import itertools
 import os
 import logging
+import re
 import json
 import argparse
+from abc import ABC, abstractmethod
+from collections import deque
+import contextlib
 import signal
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import pandas as pd
+import matplotlib
 import mplfinance as mpf
 import yfinance as yf
-from tenacity import retry, stop_after_attempt, wait_exponential
+import numpy as np
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 
-# Set script timeout (5 minutes)
-def timeout_handler(signum, frame):
-    """Handle script timeout"""
-    raise TimeoutError("Script timed out after 5 minutes")
+try:
+    import xlsxwriter
+except ImportError:  # Optional, only needed by the xlsxwriter and streaming Excel engines
+    xlsxwriter = None
 
-if os.name != 'nt':  # Only set timeout on non-Windows systems
-    signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(300)  # 5 minutes timeout  # type: ignore[attr-defined} # pylint: disable=no-member
+try:
+    import pyarrow as pa
+    import pyarrow.feather
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # Optional, only needed by the cache and the columnar export formats
+    pa = None
 
 # Load configuration
 default_analysis_dir = os.path.abspath(
@@ -35,9 +55,14 @@ except FileNotFoundError:
     CONFIG = {
         "output_directory": default_analysis_dir,
         "default_period": "2y",
+        "default_interval": "1d",
+        "float32_prices": False,
+        "price_store": True,
+        "price_store_batch": 100,
         "generate_plots": True,
         "generate_summary": True,
         "retries": 3,
+        "ticker_timeout": 300,
         "chart_settings": {
             "style": "charles",
             "colors": {
@@ -54,17 +79,89 @@ except FileNotFoundError:
             "dividends", "splits", "info"
         ],
         "export_formats": ["excel"],
+        "excel_per_type": True,
+        "excel_engine": "openpyxl",
+        "columnar_compression": "zstd",
+        "warehouse_path": None,
+        "workers": 1,
+        "chart_workers": 0,
+        "history_batch_size": 100,
+        "use_cache": True,
+        "cache_directory": os.path.join(default_analysis_dir, '.cache'),
+        "negative_cache_days": 7,
+        "correlation_block_size": 500,
+        "correlation_min_periods": 20,
+        "correlation_excel_max": 250,
+        "backtest_commission_bps": 1.0,
+        "backtest_slippage_bps": 5.0,
+        "risk_free_rate": 0.0,
+        "incremental_indicators": True,
+        "fundamentals_ttl_days": {
+            "info": 1,
+            "dividends": 1,
+            "splits": 1,
+            "quarterly_financials": 7,
+            "quarterly_balance_sheet": 7,
+            "quarterly_cashflow": 7,
+            "financials": 30,
+            "balance_sheet": 30,
+            "cashflow": 30
+        },
         "log_level": "INFO"
     }
 
+# Per-thread logging context so concurrent tickers stay distinguishable
+_log_context = threading.local()
+
+class TickerLogFilter(logging.Filter):
+    """Prefix log records with the ticker handled by the current worker thread"""
+    def filter(self, record):
+        ticker = getattr(_log_context, 'ticker', None)
+        record.ticker_prefix = f"[{ticker}] " if ticker else ""
+        return True
+
 # Configure logging
+_console_handler = logging.StreamHandler()
+_console_handler.addFilter(TickerLogFilter())
 logging.basicConfig(
     level=getattr(logging, CONFIG.get('log_level', 'INFO')),
-    format='%(message)s',
-    handlers=[logging.StreamHandler()]
+    format='%(ticker_prefix)s%(message)s',
+    handlers=[_console_handler]
 )
 logger = logging.getLogger(__name__)
 
+# mplfinance drives pyplot, which is not thread-safe
+_chart_lock = threading.Lock()
+_chart_styles = {}
+
+# Chart geometry and the horizontal pixels a candle needs to stay readable
+CHART_FIGSIZE = (15, 10)
+PIXELS_PER_CANDLE = 8
+# Indicator overlays drawn when chart_settings has no 'indicators' list; none, so
+# charts keep their plain candlestick and volume layout unless overlays are configured
+DEFAULT_CHART_INDICATORS = ()
+# Indicator columns each chart overlay plots
+CHART_OVERLAY_COLUMNS = {
+    'bollinger': ('bb_upper', 'bb_lower'),
+    'rsi': ('rsi_14',),
+    'macd': ('macd', 'macd_signal', 'macd_hist')
+}
+
+# Bar sizes charts may be aggregated to, with their approximate length
+CHART_BAR_RULES = {
+    '5min': pd.Timedelta(minutes=5),
+    '15min': pd.Timedelta(minutes=15),
+    '30min': pd.Timedelta(minutes=30),
+    'h': pd.Timedelta(hours=1),
+    '4h': pd.Timedelta(hours=4),
+    'D': pd.Timedelta(days=1),
+    'W': pd.Timedelta(weeks=1),
+    'ME': pd.Timedelta(days=31),
+    'QE': pd.Timedelta(days=92),
+    'YE': pd.Timedelta(days=366)
+}
+CHART_BAR_LABELS = {'D': 'daily', 'W': 'weekly', 'ME': 'monthly', 'QE': 'quarterly', 'YE': 'yearly'}
+
 # Data type descriptions
 DATA_TYPE_DESCRIPTIONS = {
     "historical": "Price and volume history",
@@ -89,51 +186,1548 @@ def handle_data(data, data_type=None):
         return data
     return None
 
-def remove_timezone(df):
-    """Remove timezone information while preserving datetime for plotting"""
+def _is_tz_aware(dtype) -> bool:
+    """Check for any timezone-aware datetime dtype, numpy-backed or Arrow-backed"""
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return True
+    return getattr(getattr(dtype, 'pyarrow_dtype', None), 'tz', None) is not None
+
+def remove_timezone(df, inplace: bool = False):
+    """Remove timezone information while preserving datetime for plotting
+
+    Only the index and timezone-aware columns are replaced, so by default a
+    shallow copy sharing the original data buffers is returned, and df itself
+    when there is nothing to convert. inplace=True modifies df directly.
+    """
     if df is None:
         return None
 
-    # Make a copy to avoid modifying the original data
-    df = df.copy()
-
+    tz_index = isinstance(df.index, pd.DatetimeIndex) and df.index.tz is not None
     if isinstance(df, pd.DataFrame):
-        # For DatetimeIndex, remove timezone but keep as datetime
-        if isinstance(df.index, pd.DatetimeIndex):
-            if df.index.tz is not None:
-                df.index = df.index.tz_localize(None)
-
-        # Find all datetime columns including those with timezones
-        datetime_cols = df.select_dtypes(
-            include=[
-                'datetime64[ns]',
-                'datetime64[ns, UTC]',
-                'datetime64[ns, US/Eastern]'
-            ]
-        ).columns
-        for col in datetime_cols:
-            df[col] = pd.to_datetime(df[col]).dt.tz_localize(None)
-
-        # Handle object columns that might contain datetime
-        object_cols = df.select_dtypes(include=['object']).columns
-        for col in object_cols:
-            try:
-                if pd.api.types.is_datetime64_any_dtype(df[col]):
-                    df[col] = pd.to_datetime(df[col]).dt.date
-            except (ValueError, TypeError) as e:
-                logger.debug("Error converting object column '%s' to datetime: %s", col, str(e))
-                continue
+        tz_cols = [col for col, dtype in df.dtypes.items() if _is_tz_aware(dtype)]
+        if not tz_index and not tz_cols:
+            return df
+        if not inplace:
+            df = df.copy(deep=False)
+        if tz_index:
+            df.index = df.index.tz_localize(None)
+        for col in tz_cols:
+            df[col] = df[col].dt.tz_localize(None)
     elif isinstance(df, pd.Series):
-        # If the Series has a DatetimeIndex
-        if isinstance(df.index, pd.DatetimeIndex) and df.index.tz is not None:
+        tz_values = _is_tz_aware(df.dtype)
+        if not tz_index and not tz_values:
+            return df
+        if tz_values:
+            # Series values cannot be replaced in place, build the converted Series
+            df = df.dt.tz_localize(None)
+        elif not inplace:
+            df = df.copy(deep=False)
+        if tz_index:
             df.index = df.index.tz_localize(None)
-
-        # If the Series contains datetime values
-        if pd.api.types.is_datetime64_any_dtype(df):
-            if hasattr(df, 'dt') and df.dt.tz is not None:
-                df = df.dt.tz_localize(None)
     return df
 
+# Column order produced by yf.Ticker.history, used to normalize batched downloads
+HISTORY_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+
+class PriceBars:
+    """Compact OHLCV history held as one contiguous NumPy array per column
+
+    timestamps are the timezone-naive bar times as int64 nanoseconds, in
+    ascending order. Dividend and split columns that are all zero are not
+    stored and read back as zeros. Slicing by position, or by date with
+    between(), returns views sharing the arrays, so no bars are copied.
+    The analytics, chart and export functions accept PriceBars wherever
+    they accept a history DataFrame.
+    """
+    ACTION_COLUMNS = ('Dividends', 'Stock Splits')
+
+    def __init__(self, timestamps: np.ndarray, data: dict, columns: list = None,
+                 name: str = 'Date'):
+        self.timestamps = timestamps
+        self.data = data
+        self.columns = list(columns if columns is not None else data)
+        self.name = name
+
+    @classmethod
+    def from_frame(cls, hist_data: pd.DataFrame, float32: bool = False) -> 'PriceBars':
+        """Copy a history frame into arrays of its own, optionally with float32 prices"""
+        dates = hist_data.index
+        if dates.tz is not None:
+            dates = dates.tz_localize(None)
+        data = {}
+        for col in hist_data.columns:
+            values = hist_data[col].to_numpy()
+            if col in cls.ACTION_COLUMNS and not np.nan_to_num(values).any():
+                continue
+            dtype = np.float32 if float32 and values.dtype == np.float64 else values.dtype
+            data[col] = np.array(values, dtype=dtype)
+        return cls(np.array(dates.as_unit('ns').asi8), data, list(hist_data.columns),
+                   hist_data.index.name or 'Date')
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.timestamps) == 0
+
+    @property
+    def index(self) -> pd.DatetimeIndex:
+        """Bar times as a DatetimeIndex viewing the timestamp array"""
+        return pd.DatetimeIndex(self.timestamps.view('datetime64[ns]'), name=self.name)
+
+    @property
+    def nbytes(self) -> int:
+        return self.timestamps.nbytes + sum(values.nbytes for values in self.data.values())
+
+    def __getitem__(self, key):
+        """A column's array by name, or the bars in a positional slice as views"""
+        if isinstance(key, str):
+            if key in self.data:
+                return self.data[key]
+            if key in self.columns:
+                return np.zeros(len(self))
+            raise KeyError(key)
+        return PriceBars(self.timestamps[key], {col: values[key] for col, values in self.data.items()},
+                         self.columns, self.name)
+
+    def between(self, start=None, end=None) -> 'PriceBars':
+        """Bars from start (inclusive) to end (exclusive), found by binary search"""
+        first = 0 if start is None else np.searchsorted(self.timestamps, pd.Timestamp(start).value)
+        last = (len(self) if end is None
+                else np.searchsorted(self.timestamps, pd.Timestamp(end).value))
+        return self[first:last]
+
+    def to_frame(self) -> pd.DataFrame:
+        """Return the bars as a history DataFrame backed by the same arrays"""
+        return pd.DataFrame({col: self[col] for col in self.columns}, index=self.index, copy=False)
+
+def history_frame(hist_data):
+    """Return history as a DataFrame, wrapping PriceBars arrays without copying them"""
+    return hist_data.to_frame() if isinstance(hist_data, PriceBars) else hist_data
+
+def history_column(hist_data, column: str, dtype=np.float64) -> np.ndarray:
+    """Return one column of a history DataFrame or PriceBars as an array of dtype
+
+    dtype=None keeps the stored dtype.
+    """
+    if isinstance(hist_data, PriceBars):
+        values = hist_data[column]
+        return values if dtype is None else values.astype(dtype, copy=False)
+    return hist_data[column].to_numpy(dtype=dtype)
+
+class InvalidTickerError(ValueError):
+    """Raised when Yahoo has no data for a symbol, e.g. a typo or a delisted name"""
+
+class TickerTimeoutError(Exception):
+    """Raised when a single ticker takes longer than the configured timeout
+
+    Not a TimeoutError: that is an OSError, which the cache and export
+    handlers catch and log, and the one-shot timer would be lost with it.
+    """
+
+# Errors that will fail the same way on every attempt
+NON_TRANSIENT_ERRORS = (InvalidTickerError, TickerTimeoutError, TypeError, KeyError) + tuple(
+    getattr(yf.exceptions, name) for name in (
+        'YFTickerMissingError', 'YFPricesMissingError',
+        'YFTzMissingError', 'YFInvalidPeriodError', 'YFNotImplementedError'
+    ) if hasattr(getattr(yf, 'exceptions', None), name)
+)
+
+def is_transient_error(error: BaseException) -> bool:
+    """Decide whether a failed request is worth retrying"""
+    return not isinstance(error, NON_TRANSIENT_ERRORS)
+
+@contextlib.contextmanager
+def ticker_timeout(seconds: float, ticker: str):
+    """Abort the enclosed work with TickerTimeoutError once seconds have passed
+
+    Relies on SIGALRM, so it is a no-op on Windows, outside the main thread
+    and when seconds is 0.
+    """
+    if (not seconds or os.name == 'nt'
+            or threading.current_thread() is not threading.main_thread()):
+        yield
+        return
+
+    def _handler(signum, frame):
+        raise TickerTimeoutError(f"{ticker} timed out after {seconds:g} seconds")
+
+    previous = signal.signal(signal.SIGALRM, _handler)  # pylint: disable=no-member
+    signal.setitimer(signal.ITIMER_REAL, seconds)  # pylint: disable=no-member
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)  # pylint: disable=no-member
+        signal.signal(signal.SIGALRM, previous)  # pylint: disable=no-member
+
+# Retry policy applied to each individual network request, so a transient
+# failure only repeats the request that failed
+network_retry = retry(retry=retry_if_exception(is_transient_error),
+                      stop=stop_after_attempt(CONFIG['retries']),
+                      wait=wait_exponential(multiplier=1, min=4, max=10),
+                      reraise=True)
+
+def split_batch_history(data: pd.DataFrame, tickers: list) -> dict:
+    """Split a multi-symbol yf.download frame into per-ticker history frames"""
+    histories = {}
+    if data is None or data.empty:
+        return histories
+    for ticker in tickers:
+        if isinstance(data.columns, pd.MultiIndex):
+            if ticker not in data.columns.get_level_values(0):
+                continue
+            frame = data[ticker]
+        elif len(tickers) == 1:
+            frame = data
+        else:
+            continue
+
+        # Rows only exist for this ticker where at least one price is present
+        price_cols = [col for col in ('Open', 'High', 'Low', 'Close') if col in frame.columns]
+        frame = frame.dropna(subset=price_cols, how='all')
+        if frame.empty:
+            continue
+        ordered = [col for col in HISTORY_COLUMNS if col in frame.columns]
+        frame = frame[ordered + [col for col in frame.columns if col not in ordered]]
+        frame.columns.name = None
+        if 'Volume' in frame.columns and not frame['Volume'].isna().any():
+            frame = frame.astype({'Volume': 'int64'})
+        histories[ticker] = frame
+    return histories
+
+class DataProvider(ABC):
+    """Source of price history and fundamentals data types
+
+    Subclasses implement history() and data_type(); batch_history() falls back
+    to one history() call per ticker.
+    """
+    name = 'base'
+
+    @abstractmethod
+    def history(self, ticker: str, **window) -> pd.DataFrame:
+        """Return OHLCV history for window (period=... or start=...)"""
+
+    def batch_history(self, tickers: list, **window) -> dict:
+        """Return non-empty history frames for several tickers keyed by ticker"""
+        histories = {}
+        for ticker in tickers:
+            hist_data = self.history(ticker, **window)
+            if hist_data is not None and not hist_data.empty:
+                histories[ticker] = hist_data
+        return histories
+
+    def supports(self, data_type: str) -> bool:
+        """Check whether data_type can be requested from this provider"""
+        return data_type in DATA_TYPE_DESCRIPTIONS and data_type != 'historical'
+
+    @abstractmethod
+    def data_type(self, ticker: str, data_type: str):
+        """Return the raw data for one DATA_TYPE_DESCRIPTIONS type, including info"""
+
+class YahooProvider(DataProvider):
+    """Live data from Yahoo Finance through yfinance"""
+    name = 'yahoo'
+
+    def history(self, ticker: str, **window) -> pd.DataFrame:
+        return yf.Ticker(ticker).history(**window)
+
+    def batch_history(self, tickers: list, **window) -> dict:
+        # ignore_tz keeps each ticker's bars in its exchange's local time, as
+        # Ticker.history() does, instead of the batch's most common timezone
+        data = yf.download(tickers, group_by='ticker', auto_adjust=True, actions=True,
+                           threads=True, progress=False, ignore_tz=True, **window)
+        return split_batch_history(data, tickers)
+
+    def supports(self, data_type: str) -> bool:
+        # Check the class so the lookup does not trigger a download
+        return super().supports(data_type) and hasattr(yf.Ticker, data_type)
+
+    def data_type(self, ticker: str, data_type: str):
+        return getattr(yf.Ticker(ticker), data_type)
+
+class ReplayProvider(DataProvider):
+    """Offline provider replaying responses recorded on disk
+
+    Expects <directory>/<TICKER>/history.pkl.gz (history_<interval>.pkl.gz for
+    intraday bars) and <directory>/<TICKER>/<data_type>.pkl.gz files holding
+    the objects the live provider returned. Missing history
+    replays as an empty frame and missing data types as None, like Yahoo.
+    """
+    name = 'replay'
+
+    def __init__(self, directory: str):
+        if not os.path.isdir(directory):
+            raise FileNotFoundError(f"Replay directory not found: {directory}")
+        self.directory = directory
+
+    def _load(self, ticker: str, name: str):
+        path = os.path.join(self.directory, ticker, f"{name}.pkl.gz")
+        if not os.path.exists(path):
+            return None
+        return pd.read_pickle(path)
+
+    def history(self, ticker: str, **window) -> pd.DataFrame:
+        hist_data = self._load(ticker, history_record_name(window.get('interval')))
+        if hist_data is None:
+            return pd.DataFrame()
+        # Recorded bars are replayed as-is for a period; start and end still trim them
+        dates = hist_data.index
+        if isinstance(dates, pd.DatetimeIndex) and dates.tz is not None:
+            dates = dates.tz_localize(None)
+        if window.get('start') is not None:
+            hist_data = hist_data[dates >= pd.Timestamp(window['start'])]
+            dates = dates[dates >= pd.Timestamp(window['start'])]
+        if window.get('end') is not None:
+            hist_data = hist_data[dates < pd.Timestamp(window['end'])]
+        return hist_data
+
+    def data_type(self, ticker: str, data_type: str):
+        return self._load(ticker, data_type)
+
+class RecordingProvider(DataProvider):
+    """Wrap another provider and save every response in the ReplayProvider layout
+
+    Payloads are gzip-compressed pickles; manifest.json lists what was recorded,
+    when, and the history window that was requested.
+    """
+    name = 'record'
+
+    def __init__(self, inner: DataProvider, directory: str):
+        self.inner = inner
+        self.directory = directory
+        self._manifest_lock = threading.Lock()
+        self._recorded = set()
+        self._manifest_path = os.path.join(directory, 'manifest.json')
+        try:
+            with open(self._manifest_path, 'r', encoding="utf-8") as manifest_file:
+                self._manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            self._manifest = {'provider': inner.name, 'tickers': {}}
+
+    def _save(self, ticker: str, name: str, data, **details):
+        ticker_dir = os.path.join(self.directory, ticker)
+        os.makedirs(ticker_dir, exist_ok=True)
+        pd.to_pickle(data, os.path.join(ticker_dir, f"{name}.pkl.gz"))
+        details = {key: str(value) for key, value in details.items() if value is not None}
+        with self._manifest_lock:
+            self._manifest['tickers'].setdefault(ticker, {})[name] = {
+                'recorded': datetime.now().isoformat(), **details
+            }
+            with open(self._manifest_path, 'w', encoding="utf-8") as manifest_file:
+                json.dump(self._manifest, manifest_file, indent=2)
+
+    def _save_history(self, ticker: str, hist_data: pd.DataFrame, **window):
+        """Record history, merging the windows of a chunked download into one file"""
+        name = history_record_name(window.get('interval'))
+        with self._manifest_lock:
+            earlier = (ticker, name) in self._recorded
+            self._recorded.add((ticker, name))
+        if earlier and hist_data is not None and not hist_data.empty:
+            recorded = pd.read_pickle(os.path.join(self.directory, ticker, f"{name}.pkl.gz"))
+            hist_data = stitch_history([recorded, hist_data])
+        self._save(ticker, name, hist_data, **window)
+
+    def history(self, ticker: str, **window) -> pd.DataFrame:
+        hist_data = self.inner.history(ticker, **window)
+        self._save_history(ticker, hist_data, **window)
+        return hist_data
+
+    def batch_history(self, tickers: list, **window) -> dict:
+        histories = self.inner.batch_history(tickers, **window)
+        for ticker, hist_data in histories.items():
+            self._save_history(ticker, hist_data, **window)
+        return histories
+
+    def supports(self, data_type: str) -> bool:
+        return self.inner.supports(data_type)
+
+    def data_type(self, ticker: str, data_type: str):
+        data = self.inner.data_type(ticker, data_type)
+        if data is not None:
+            self._save(ticker, data_type, data)
+        return data
+
+_provider = YahooProvider()
+
+def get_provider() -> DataProvider:
+    """Return the data provider used for all downloads"""
+    return _provider
+
+def set_provider(provider: DataProvider):
+    """Replace the data provider used for all downloads"""
+    global _provider  # pylint: disable=global-statement
+    _provider = provider
+
+@network_retry
+def request_history(ticker: str, **window) -> pd.DataFrame:
+    """Download price history for a single ticker"""
+    return get_provider().history(ticker, **window)
+
+@network_retry
+def request_batch_history(tickers: list, **window) -> dict:
+    """Download price history for several tickers in one multi-symbol request"""
+    return get_provider().batch_history(tickers, **window)
+
+@network_retry
+def request_data_type(ticker: str, data_type: str):
+    """Download one fundamentals data type for a single ticker"""
+    return get_provider().data_type(ticker, data_type)
+
+def request_history_windows(ticker: str, interval: str = '1d', **window) -> pd.DataFrame:
+    """Download price history for one ticker, one request per window Yahoo allows"""
+    frames = [request_history(ticker, **request_window)
+              for request_window in history_windows(interval, **window)]
+    return frames[0] if len(frames) == 1 else stitch_history(frames)
+
+def download_histories(tickers: list, batch_size: int, interval: str = '1d', **window) -> dict:
+    """Download price history for many tickers using one multi-symbol request per chunk
+
+    window is passed through to the provider (period=... or start=...).
+    Intraday intervals are split into the request windows Yahoo allows and
+    stitched back together per ticker. Tickers missing from the result are
+    left out so callers can fall back to per-ticker downloads.
+    """
+    request_windows = history_windows(interval, **window)
+    pieces = {}
+    for chunk_start in range(0, len(tickers), batch_size):
+        chunk = tickers[chunk_start:chunk_start + batch_size]
+        logger.info("\nDownloading history for %d ticker(s) in %d request(s)...",
+                    len(chunk), len(request_windows))
+        for request_window in request_windows:
+            try:
+                for ticker, hist_data in request_batch_history(chunk, **request_window).items():
+                    pieces.setdefault(ticker, []).append(hist_data)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning("Batch history download failed: %s", str(e))
+    return {ticker: frames[0] if len(frames) == 1 else stitch_history(frames)
+            for ticker, frames in pieces.items()}
+
+# Day-count periods are trading sessions: a 5d download returns the last five
+# sessions, however many weekend and holiday days they span
+SESSION_PERIODS = {'1d': 1, '5d': 5}
+
+# Offsets matching yfinance period strings, used to decide what the cache covers.
+# The session periods reach back far enough to include weekends and holidays.
+PERIOD_OFFSETS = {
+    '1d': pd.DateOffset(days=5),
+    '5d': pd.DateOffset(days=12),
+    '1mo': pd.DateOffset(months=1),
+    '3mo': pd.DateOffset(months=3),
+    '6mo': pd.DateOffset(months=6),
+    '1y': pd.DateOffset(years=1),
+    '2y': pd.DateOffset(years=2),
+    '5y': pd.DateOffset(years=5),
+    '10y': pd.DateOffset(years=10)
+}
+
+def period_start(period: str):
+    """Return the first timestamp covered by a yfinance period, or None for 'max'"""
+    today = pd.Timestamp.now().normalize()
+    if period == 'max':
+        return None
+    if period == 'ytd':
+        return today.replace(month=1, day=1)
+    if period not in PERIOD_OFFSETS:
+        raise ValueError(f"Unsupported period for caching: {period}")
+    return today - PERIOD_OFFSETS[period]
+
+# Yahoo limits for intraday bars: (days per request, days of history available)
+INTRADAY_LIMITS = {
+    '1m': (7, 30),
+    '5m': (60, 60),
+    '15m': (60, 60),
+    '1h': (730, 730)
+}
+INTERVALS = ('1d',) + tuple(INTRADAY_LIMITS)
+
+def history_start(period: str, interval: str = '1d'):
+    """Return the first timestamp a download of period can cover at interval"""
+    start = period_start(period)
+    if interval in INTRADAY_LIMITS:
+        available = INTRADAY_LIMITS[interval][1]
+        earliest = pd.Timestamp.now().normalize() - pd.Timedelta(days=available - 1)
+        start = earliest if start is None else max(start, earliest)
+    return start
+
+def history_windows(interval: str = '1d', period: str = None, start=None) -> list:
+    """Split a history request into the windows Yahoo serves for interval
+
+    Daily bars are one request for period or from start. Intraday bars are
+    requested as consecutive start/end windows no longer than Yahoo's
+    per-request limit, from start or the beginning of period.
+    """
+    if interval not in INTRADAY_LIMITS:
+        window = {'start': start} if start is not None else {'period': period}
+        if interval != '1d':
+            window['interval'] = interval
+        return [window]
+    start = pd.Timestamp(start) if start is not None else history_start(period, interval)
+    end = pd.Timestamp.now().normalize() + pd.Timedelta(days=1)
+    step = pd.Timedelta(days=INTRADAY_LIMITS[interval][0])
+    windows = []
+    while True:
+        stop = min(start + step, end)
+        windows.append({'start': start.date(), 'end': stop.date(), 'interval': interval})
+        if stop >= end:
+            return windows
+        start = stop
+
+def history_record_name(interval: str = None) -> str:
+    """Name recorded history is stored under for interval"""
+    return 'history' if interval in (None, '1d') else f"history_{interval}"
+
+def stitch_history(frames: list) -> pd.DataFrame:
+    """Join history downloaded in windows, keeping the latest copy of overlapping bars"""
+    frames = [frame for frame in frames if frame is not None and not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    stitched = pd.concat(frames)
+    return stitched[~stitched.index.duplicated(keep='last')].sort_index()
+
+# Intraday bars are stored with 32-bit prices: a month of 1-minute bars for
+# hundreds of tickers is millions of rows, and float32 keeps ~7 significant digits
+COMPACT_PRICE_COLUMNS = ('Open', 'High', 'Low', 'Close', 'Dividends', 'Stock Splits',
+                         'Capital Gains')
+
+def compact_history(hist_data: pd.DataFrame) -> pd.DataFrame:
+    """Store prices as float32 and volume as the smallest integer type that holds it"""
+    if hist_data is None or hist_data.empty:
+        return hist_data
+    dtypes = {col: 'float32' for col in COMPACT_PRICE_COLUMNS if col in hist_data.columns}
+    if 'Volume' in hist_data.columns and not hist_data['Volume'].isna().any():
+        dtypes['Volume'] = 'int32' if hist_data['Volume'].max() < 2 ** 31 else 'int64'
+    return hist_data.astype(dtypes)
+
+def prepare_history(hist_data: pd.DataFrame, interval: str = '1d') -> pd.DataFrame:
+    """Make downloaded history timezone-naive, compacting intraday bars"""
+    hist_data = remove_timezone(hist_data, inplace=True)
+    return compact_history(hist_data) if interval in INTRADAY_LIMITS else hist_data
+
+def price_bars(hist_data):
+    """Hold history handed to the analysis as PriceBars, float32 if configured
+
+    The bars get arrays of their own, so the downloaded or cached frame they
+    are built from, often longer than the period, can be freed.
+    """
+    if hist_data is None or hist_data.empty or isinstance(hist_data, PriceBars):
+        return hist_data
+    return PriceBars.from_frame(hist_data, float32=CONFIG.get('float32_prices', False))
+
+def slice_to_period(hist_data: pd.DataFrame, period: str, interval: str = '1d') -> pd.DataFrame:
+    """Trim history to the bars a fresh download of period would return
+
+    Session periods keep the last N trading days present in the history, and
+    a non-empty history always keeps at least its last session, so a weekend
+    run or a stale cache never turns into an empty result.
+    """
+    if hist_data is None or hist_data.empty:
+        return hist_data
+    try:
+        start = history_start(period, interval)
+    except ValueError:
+        return hist_data
+    sessions = hist_data.index.normalize().unique()
+    first_session = sessions[-min(SESSION_PERIODS.get(period, 1), len(sessions))]
+    if period in SESSION_PERIODS:
+        start = first_session if start is None else max(start, first_session)
+    elif start is None:
+        return hist_data
+    else:
+        start = min(start, first_session)
+    if isinstance(hist_data, PriceBars):
+        return hist_data.between(start)
+    return hist_data[hist_data.index >= start]
+
+def cache_path(*parts) -> str:
+    """Build a path inside the local data cache"""
+    return os.path.join(CONFIG.get('cache_directory', os.path.join(default_analysis_dir, '.cache')),
+                        *parts)
+
+def _history_cache_files(ticker: str, interval: str):
+    base = cache_path('history', f"{ticker}_{interval}")
+    return base + '.parquet', base + '.json'
+
+def cached_tickers(interval: str = '1d') -> list:
+    """List the tickers with cached price history for interval"""
+    suffix = f"_{interval}.parquet"
+    try:
+        names = os.listdir(cache_path('history'))
+    except OSError:
+        return []
+    return sorted(name[:-len(suffix)] for name in names if name.endswith(suffix))
+
+def load_cached_history(ticker: str, period: str, interval: str = '1d'):
+    """Return (history, covered_start) from the cache if it covers period, else None"""
+    if not CONFIG.get('use_cache', True) or CONFIG.get('refresh'):
+        return None
+    data_path, meta_path = _history_cache_files(ticker, interval)
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return None
+    try:
+        with open(meta_path, 'r', encoding="utf-8") as meta_file:
+            cached_start = json.load(meta_file).get('start')
+        start = history_start(period, interval)
+        # A cache filled from a shorter period cannot serve a longer one
+        if cached_start is not None and (start is None or pd.Timestamp(cached_start) > start):
+            return None
+        hist_data = pd.read_parquet(data_path)
+    except (OSError, ValueError, ImportError) as e:
+        logger.debug("Ignoring history cache for %s: %s", ticker, str(e))
+        return None
+    if hist_data.empty:
+        return None
+    return hist_data, cached_start
+
+def save_cached_history(ticker: str, hist_data: pd.DataFrame, covered_start,
+                        interval: str = '1d'):
+    """Write timezone-naive history and the first date it is complete from to the cache"""
+    if not CONFIG.get('use_cache', True) or hist_data is None or hist_data.empty:
+        return
+    data_path, meta_path = _history_cache_files(ticker, interval)
+    try:
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        # Write to a temporary file first so an interrupted run never leaves a torn cache
+        hist_data.to_parquet(data_path + '.tmp')
+        os.replace(data_path + '.tmp', data_path)
+        with open(meta_path, 'w', encoding="utf-8") as meta_file:
+            json.dump({
+                'start': None if covered_start is None else pd.Timestamp(covered_start).isoformat(),
+                'updated': datetime.now().isoformat()
+            }, meta_file)
+    except (OSError, ValueError, ImportError) as e:
+        logger.warning("Could not update history cache for %s: %s", ticker, str(e))
+
+def has_corporate_action(cached: pd.DataFrame, new_data: pd.DataFrame) -> bool:
+    """Check whether new bars carry a dividend or split, which re-adjusts earlier prices"""
+    fresh = new_data[new_data.index > cached.index[-1]]
+    action_cols = [col for col in ('Dividends', 'Stock Splits') if col in fresh.columns]
+    return bool(action_cols) and bool((fresh[action_cols].fillna(0) != 0).to_numpy().any())
+
+def merge_history(cached: pd.DataFrame, new_data: pd.DataFrame) -> pd.DataFrame:
+    """Append newly downloaded bars to cached history, replacing overlapping bars"""
+    if new_data is None or new_data.empty:
+        return cached
+    merged = pd.concat([cached[cached.index < new_data.index[0]], new_data])
+    merged = merged[~merged.index.duplicated(keep='last')].sort_index()
+    # Concatenating int32 and int64 volume upcasts; keep the compact dtypes
+    return compact_history(merged) if cached['Close'].dtype == np.float32 else merged
+
+def cache_period_start(period: str, interval: str = '1d'):
+    """Return the covered start recorded for a full download of period"""
+    try:
+        return history_start(period, interval)
+    except ValueError:
+        return pd.Timestamp.now().normalize()
+
+# Memory-mapped price store: one flat file per field with every ticker's bars
+# back to back, and an index of each ticker's rows
+STORE_FIELDS = ('Open', 'High', 'Low', 'Close', 'Volume')
+_store_lock = threading.Lock()
+
+class PriceStore:
+    """Memory-mapped price history of many tickers for random access across runs
+
+    The int64 timestamps and each field are flat binary files under
+    directory, holding every ticker's bars back to back in ascending time.
+    index.json maps each ticker to its offset, length, the first date its
+    bars are complete from, the rows reserved for it and a checksum of its
+    bars. Opening the store reads only the index; bars() returns PriceBars
+    viewing the mapped files, so data is paged in only as it is read and
+    date slices are binary searches of the timestamps.
+    A ticker whose stored bars are a prefix of the new ones, save for bars
+    that changed at the end, only has the changed and new rows written, in
+    place while they fit its reserved rows. Otherwise its bars are appended
+    and the index entry moved; the rows left behind are reclaimed into a
+    new generation of files once they outnumber the live ones.
+    """
+
+    def __init__(self, directory: str, price_dtype: str = 'float64'):
+        self.directory = directory
+        self.price_dtype = price_dtype
+        self._load_index()
+
+    def _load_index(self):
+        self.index, self.rows, self.generation = {}, 0, 0
+        self._maps = {}
+        try:
+            with open(os.path.join(self.directory, 'index.json'), 'r',
+                      encoding="utf-8") as index_file:
+                meta = json.load(index_file)
+            # Entries written before reservations and checksums reserve nothing extra
+            self.index = {ticker: (tuple(entry) + (entry[1], None))[:5]
+                          for ticker, entry in meta['tickers'].items()}
+            self.rows, self.generation = meta['rows'], meta['generation']
+            self.price_dtype = meta['price_dtype']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _fields(self) -> list:
+        return [('timestamps', np.dtype(np.int64))] + [
+            (field, np.dtype(self.price_dtype)) for field in STORE_FIELDS]
+
+    def _path(self, field: str, generation: int = None) -> str:
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.directory, f"{field.lower()}.{generation}.bin")
+
+    def _map(self, field: str, dtype) -> np.memmap:
+        if field not in self._maps:
+            self._maps[field] = np.memmap(self._path(field), dtype=dtype, mode='r',
+                                          shape=(self.rows,))
+        return self._maps[field]
+
+    @staticmethod
+    def _reserve(length: int) -> int:
+        """Rows to reserve for a ticker's bars, leaving room for bars appended later"""
+        return length + max(length // 8, 32)
+
+    @property
+    def tickers(self) -> list:
+        return sorted(self.index)
+
+    def __contains__(self, ticker: str) -> bool:
+        return ticker in self.index
+
+    def covers(self, ticker: str, start) -> bool:
+        """Whether the stored bars of ticker are complete from start (None for all history)"""
+        if ticker not in self.index:
+            return False
+        covered = self.index[ticker][2]
+        return covered is None or (start is not None and pd.Timestamp(covered) <= start)
+
+    def bars(self, ticker: str, start=None, end=None) -> PriceBars:
+        """The ticker's bars from start to end as views of the mapped files"""
+        offset, length = self.index[ticker][:2]
+        rows = slice(offset, offset + length)
+        fields = dict(self._fields())
+        bars = PriceBars(self._map('timestamps', fields.pop('timestamps'))[rows],
+                         {field: self._map(field, dtype)[rows] for field, dtype in fields.items()},
+                         list(STORE_FIELDS))
+        return bars if start is None and end is None else bars.between(start, end)
+
+    def _arrays(self, bars: PriceBars) -> dict:
+        """The bars as one contiguous array per stored field, in the store's dtypes"""
+        arrays = {}
+        for field, dtype in self._fields():
+            values = (bars.timestamps if field == 'timestamps'
+                      else history_column(bars, field, dtype)
+                      if field in bars.columns else np.full(len(bars), np.nan, dtype))
+            arrays[field] = np.ascontiguousarray(values, dtype=dtype)
+        return arrays
+
+    @staticmethod
+    def _checksum(arrays: dict) -> int:
+        checksum = 0
+        for values in arrays.values():
+            checksum = zlib.crc32(values, checksum)
+        return checksum
+
+    def _holds(self, ticker: str, length: int, covered, checksum: int) -> bool:
+        """Whether the store already has exactly these bars for ticker"""
+        entry = self.index.get(ticker)
+        return entry is not None and (entry[1], entry[2], entry[4]) == (length, covered, checksum)
+
+    def _kept_rows(self, ticker: str, arrays: dict):
+        """Number of leading stored rows of ticker equal to the new bars
+
+        None when the stored timestamps are not a prefix of the new ones.
+        """
+        entry = self.index.get(ticker)
+        if entry is None or entry[1] > len(arrays['timestamps']):
+            return None
+        stored = self.bars(ticker)
+        length = len(stored)
+        if not np.array_equal(stored.timestamps, arrays['timestamps'][:length]):
+            return None
+        kept = length
+        for field in STORE_FIELDS:
+            old, new = stored[field], arrays[field][:kept]
+            changed = np.flatnonzero((old[:kept] != new) & ~(np.isnan(old[:kept]) & np.isnan(new)))
+            if len(changed):
+                kept = int(changed[0])
+        return kept
+
+    def write(self, histories: dict):
+        """Store {ticker: (bars, covered_start)}, replacing what the store held for each"""
+        with _store_lock:
+            self._load_index()
+            changed = {}
+            for ticker, (bars, covered) in histories.items():
+                if isinstance(bars, pd.DataFrame):
+                    bars = PriceBars.from_frame(bars)
+                if bars.empty:
+                    continue
+                covered = None if covered is None else pd.Timestamp(covered).isoformat()
+                arrays = self._arrays(bars)
+                checksum = self._checksum(arrays)
+                if not self._holds(ticker, len(bars), covered, checksum):
+                    changed[ticker] = (arrays, covered, checksum)
+            if not changed:
+                self._maps = {}
+                return
+
+            # Write each ticker from its first changed row in place when its bars
+            # still fit the reserved rows, and append the others at the end
+            placements = {}
+            end = self.rows
+            for ticker, (arrays, _, _) in changed.items():
+                kept = self._kept_rows(ticker, arrays) if self.rows else None
+                length = len(arrays['timestamps'])
+                if kept is not None and length <= self.index[ticker][3]:
+                    placements[ticker] = (self.index[ticker][0], kept, self.index[ticker][3])
+                else:
+                    placements[ticker] = (end, 0, self._reserve(length))
+                    end += placements[ticker][2]
+            # Release the maps before the files change underneath them
+            self._maps = {}
+            os.makedirs(self.directory, exist_ok=True)
+            for field, dtype in self._fields():
+                path = self._path(field)
+                with open(path, 'r+b' if os.path.exists(path) else 'wb') as data_file:
+                    for ticker, (offset, kept, _) in placements.items():
+                        data_file.seek((offset + kept) * dtype.itemsize)
+                        changed[ticker][0][field][kept:].tofile(data_file)
+                    # Rows past the index are a torn earlier write; drop them
+                    data_file.truncate(end * dtype.itemsize)
+            for ticker, (offset, _, reserved) in placements.items():
+                arrays, covered, checksum = changed[ticker]
+                self.index[ticker] = (offset, len(arrays['timestamps']), covered, reserved,
+                                      checksum)
+            self.rows = end
+
+            previous = self.generation
+            if sum(entry[3] for entry in self.index.values()) * 2 < self.rows:
+                self._compact()
+            self._save_index()
+            if self.generation != previous:
+                for field, _ in self._fields():
+                    os.remove(self._path(field, previous))
+
+    def _compact(self):
+        """Copy the live rows into a new generation of files"""
+        generation = self.generation + 1
+        entries = sorted(self.index.items(), key=lambda item: item[1][0])
+        for field, dtype in self._fields():
+            source = np.memmap(self._path(field), dtype=dtype, mode='r', shape=(self.rows,))
+            with open(self._path(field, generation), 'wb') as data_file:
+                offset = 0
+                for _, (start, length, _, reserved, _) in entries:
+                    data_file.seek(offset * dtype.itemsize)
+                    source[start:start + length].tofile(data_file)
+                    offset += reserved
+                data_file.truncate(offset * dtype.itemsize)
+            del source
+        offset = 0
+        for ticker, (_, length, covered, reserved, checksum) in entries:
+            self.index[ticker] = (offset, length, covered, reserved, checksum)
+            offset += reserved
+        self.rows, self.generation = offset, generation
+
+    def _save_index(self):
+        path = os.path.join(self.directory, 'index.json')
+        with open(path + '.tmp', 'w', encoding="utf-8") as index_file:
+            json.dump({'rows': self.rows, 'generation': self.generation,
+                       'price_dtype': self.price_dtype,
+                       'tickers': {ticker: list(entry) for ticker, entry in self.index.items()}},
+                      index_file)
+        os.replace(path + '.tmp', path)
+
+def price_store(interval: str = '1d') -> PriceStore:
+    """Open the price store for interval; intraday stores hold float32 prices"""
+    return PriceStore(cache_path('store', interval),
+                      'float32' if interval in INTRADAY_LIMITS else 'float64')
+
+def update_price_store(histories: dict, interval: str = '1d'):
+    """Write {ticker: (bars, covered_start)} to the price store, logging failures"""
+    if not histories or not CONFIG.get('use_cache', True) or not CONFIG.get('price_store', True):
+        return
+    try:
+        price_store(interval).write(histories)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not update the price store: %s", str(e))
+
+def load_period_histories(tickers: list, period: str) -> dict:
+    """Daily history of tickers for period, memory-mapped from the price store
+
+    Tickers the store does not cover for period are read from the history
+    cache instead; tickers in neither are left out. An empty tickers list
+    means every ticker in the store or the cache.
+    """
+    store = price_store()
+    tickers = list(tickers) or sorted(set(store.tickers) | set(cached_tickers()))
+    try:
+        start = period_start(period)
+    except ValueError:
+        start = pd.Timestamp.now().normalize()
+    histories = {}
+    for ticker in tickers:
+        if store.covers(ticker, start):
+            histories[ticker] = slice_to_period(store.bars(ticker, start), period)
+            continue
+        cached = load_cached_history(ticker, period)
+        if cached is not None and not cached[0].empty:
+            histories[ticker] = price_bars(slice_to_period(cached[0], period))
+    return {ticker: bars for ticker, bars in histories.items() if not bars.empty}
+
+def _month_id(when) -> int:
+    return when.year * 12 + when.month
+
+class IndicatorState:
+    """Running summary-metric state for one ticker's period window
+
+    Holds running sums for the moving averages, monotonic deques for the
+    52-week high and low and a Welford accumulator for return variance, so
+    each new bar is folded in in constant time. Every bar of the window but
+    the last is committed; the last one may still be revised (an unfinished
+    session) and only enters the metrics when they are read.
+    """
+    HIGH_LOW_BARS = 252
+    MA_WINDOWS = (50, 200)
+
+    def __init__(self, window_start):
+        self.window_start = pd.Timestamp(window_start)
+        self.first_bar = None
+        self.last_committed = None
+        self.last_close = None
+        self.seq = 0
+        # Last committed closes, enough to drop the oldest from every moving-average sum
+        self.tail = deque()
+        # Sum of the last (window - 1) committed closes; the pending bar completes the window
+        self.sums = {window: 0.0 for window in self.MA_WINDOWS}
+        # (seq, timestamp, value) with values strictly decreasing (highs) or increasing (lows)
+        self.highs = deque()
+        self.lows = deque()
+        # Welford accumulator over the committed bar-to-bar returns of the window
+        self.returns = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        # Last committed close of the latest months and first committed close of the latest years
+        self.month_last = {}
+        self.year_first = {}
+
+    def _add_return(self, value: float):
+        self.returns += 1
+        delta = value - self.mean
+        self.mean += delta / self.returns
+        self.m2 += delta * (value - self.mean)
+
+    def _remove_return(self, value: float):
+        if self.returns <= 1:
+            self.returns, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        old_mean = self.mean
+        self.returns -= 1
+        self.mean = (old_mean * (self.returns + 1) - value) / self.returns
+        self.m2 = max(self.m2 - (value - old_mean) * (value - self.mean), 0.0)
+
+    def push(self, when, close: float, high: float, low: float):
+        """Commit the next bar of the window"""
+        when = pd.Timestamp(when)
+        self.last_committed = when
+        if np.isnan(close):
+            return
+        if self.first_bar is None:
+            self.first_bar = when
+        if self.last_close is not None:
+            self._add_return(close / self.last_close - 1)
+        self.last_close = close
+        self.seq += 1
+
+        self.tail.append((when, close))
+        for window in self.MA_WINDOWS:
+            self.sums[window] += close
+            if len(self.tail) > window - 1:
+                self.sums[window] -= self.tail[-window][1]
+        if len(self.tail) > max(self.MA_WINDOWS) - 1:
+            self.tail.popleft()
+
+        for extremes, value, beaten in ((self.highs, high, lambda old: old <= high),
+                                        (self.lows, low, lambda old: old >= low)):
+            while extremes and beaten(extremes[-1][2]):
+                extremes.pop()
+            extremes.append((self.seq, when, value))
+            while extremes[0][0] <= self.seq - (self.HIGH_LOW_BARS - 1):
+                extremes.popleft()
+
+        self.month_last[_month_id(when)] = (when, close)
+        self.year_first.setdefault(when.year, (when, close))
+        for stale in [month for month in self.month_last if month < _month_id(when) - 1]:
+            del self.month_last[stale]
+        for stale in [year for year in self.year_first if year < when.year]:
+            del self.year_first[stale]
+
+    def advance_start(self, hist_data: pd.DataFrame, window_start):
+        """Drop committed bars that fell out of the window when its start moved forward
+
+        hist_data is the full cached history, which still holds the dropped bars.
+        """
+        window_start = pd.Timestamp(window_start)
+        if window_start <= self.window_start:
+            return
+        self.window_start = window_start
+        if self.first_bar is None or self.first_bar >= window_start:
+            return
+        index, column = hist_data.index, hist_data['Close']
+        cut = int(index.searchsorted(window_start))
+        end = int(index.searchsorted(self.last_committed, side='right'))
+        dropped = column.iloc[int(index.searchsorted(self.first_bar)):cut].dropna()
+        # The first committed bar left in the window, whose return now leaves it too
+        after = next((pos for pos in range(cut, end) if not pd.isna(column.iloc[pos])), None)
+        closes = dropped.to_numpy(dtype=np.float64)
+        if after is not None:
+            closes = np.append(closes, float(column.iloc[after]))
+        for pos in range(1, len(closes)):
+            self._remove_return(closes[pos] / closes[pos - 1] - 1)
+
+        for when in dropped.index:
+            if self.tail and self.tail[0][0] == when:
+                for window in self.MA_WINDOWS:
+                    if len(self.tail) <= window - 1:
+                        self.sums[window] -= self.tail[0][1]
+                self.tail.popleft()
+        for extremes in (self.highs, self.lows):
+            while extremes and extremes[0][1] < window_start:
+                extremes.popleft()
+        for month, (when, _) in list(self.month_last.items()):
+            if when < window_start:
+                del self.month_last[month]
+        for year, (when, _) in list(self.year_first.items()):
+            if when < window_start:
+                if after is not None and index[after].year == year:
+                    self.year_first[year] = (index[after], closes[-1])
+                else:
+                    del self.year_first[year]
+
+        if after is None:
+            self.first_bar, self.last_close = None, None
+        else:
+            self.first_bar = index[after]
+
+    def metrics(self, when, close: float, high: float, low: float) -> dict:
+        """Return the SUMMARY_METRICS values with the pending last bar folded in"""
+        when = pd.Timestamp(when)
+        bars = len(self.tail) + 1
+        high_52w = max(high, self.highs[0][2]) if self.highs else high
+        low_52w = min(low, self.lows[0][2]) if self.lows else low
+
+        returns, mean, m2 = self.returns, self.mean, self.m2
+        if self.last_close is not None:
+            value = close / self.last_close - 1
+            returns += 1
+            delta = value - mean
+            mean += delta / returns
+            m2 += delta * (value - mean)
+        volatility = (m2 / (returns - 1)) ** 0.5 * 252 ** 0.5 if returns > 1 else np.nan
+
+        prev_month = self.month_last.get(_month_id(when) - 1)
+        current_year = datetime.now().year
+        if current_year in self.year_first:
+            ytd_start = self.year_first[current_year][1]
+        else:
+            ytd_start = close if when.year == current_year else np.nan
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return {
+                'price': close,
+                'high_52w': high_52w,
+                'low_52w': low_52w,
+                'dist_52w_high_pct': (close / high_52w - 1) * 100,
+                'dist_52w_low_pct': (close / low_52w - 1) * 100,
+                **{f"ma_{window}": (self.sums[window] + close) / window
+                   if bars >= window else np.nan for window in self.MA_WINDOWS},
+                'volatility_pct': volatility * 100,
+                'return_1m_pct': (close / prev_month[1] - 1) * 100 if prev_month else np.nan,
+                'return_ytd_pct': (close / ytd_start - 1) * 100,
+                'last_date': when
+            }
+
+    def to_dict(self) -> dict:
+        def stamp(when):
+            return None if when is None else when.isoformat()
+        return {
+            'window_start': stamp(self.window_start),
+            'first_bar': stamp(self.first_bar),
+            'last_committed': stamp(self.last_committed),
+            'last_close': self.last_close,
+            'seq': self.seq,
+            'tail': [[stamp(when), close] for when, close in self.tail],
+            'sums': {str(window): total for window, total in self.sums.items()},
+            'highs': [[seq, stamp(when), value] for seq, when, value in self.highs],
+            'lows': [[seq, stamp(when), value] for seq, when, value in self.lows],
+            'welford': [self.returns, self.mean, self.m2],
+            'month_last': {str(month): [stamp(when), close]
+                           for month, (when, close) in self.month_last.items()},
+            'year_first': {str(year): [stamp(when), close]
+                           for year, (when, close) in self.year_first.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'IndicatorState':
+        def stamp(value):
+            return None if value is None else pd.Timestamp(value)
+        state = cls(data['window_start'])
+        state.first_bar = stamp(data['first_bar'])
+        state.last_committed = stamp(data['last_committed'])
+        state.last_close = data['last_close']
+        state.seq = data['seq']
+        state.tail = deque((stamp(when), close) for when, close in data['tail'])
+        state.sums = {int(window): total for window, total in data['sums'].items()}
+        state.highs = deque((seq, stamp(when), value) for seq, when, value in data['highs'])
+        state.lows = deque((seq, stamp(when), value) for seq, when, value in data['lows'])
+        state.returns, state.mean, state.m2 = data['welford']
+        state.month_last = {int(month): (stamp(when), close)
+                            for month, (when, close) in data['month_last'].items()}
+        state.year_first = {int(year): (stamp(when), close)
+                            for year, (when, close) in data['year_first'].items()}
+        return state
+
+def _indicator_state_file(ticker: str, period: str, interval: str = '1d') -> str:
+    return cache_path('history', f"{ticker}_{interval}_{period}.state.json")
+
+def load_indicator_state(ticker: str, period: str, interval: str = '1d'):
+    """Return the persisted IndicatorState for a ticker and period, or None"""
+    path = _indicator_state_file(ticker, period, interval)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding="utf-8") as state_file:
+            return IndicatorState.from_dict(json.load(state_file))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.debug("Ignoring indicator state for %s: %s", ticker, str(e))
+        return None
+
+def update_indicator_state(ticker: str, hist_data: pd.DataFrame, period: str,
+                           interval: str = '1d'):
+    """Fold the bars added to the cached history into the ticker's indicator state
+
+    Only bars after the last committed one are pushed, and bars that left the
+    period window are dropped, so the cost follows the new data rather than
+    the length of the history. The state is rebuilt from the window when the
+    history was rewritten, e.g. re-adjusted after a corporate action.
+    """
+    if (not CONFIG.get('use_cache', True) or not CONFIG.get('incremental_indicators', True)
+            or hist_data is None or hist_data.empty):
+        return
+    try:
+        start = period_start(period)
+    except ValueError:
+        return
+    window_start = hist_data.index[0] if start is None else max(start, hist_data.index[0])
+    state = load_indicator_state(ticker, period, interval)
+    last = len(hist_data) - 1
+    if state is not None and state.last_committed is not None:
+        committed = int(hist_data.index.get_indexer([state.last_committed])[0])
+        if committed < 0 or committed >= last or window_start < state.window_start:
+            state = None
+        elif (state.tail and state.tail[-1][0] == state.last_committed
+              and not np.isclose(hist_data['Close'].iloc[committed], state.last_close)):
+            # Earlier prices were re-adjusted, the running values no longer apply
+            state = None
+    else:
+        state = None
+    if state is None:
+        state = IndicatorState(window_start)
+        committed = int(hist_data.index.searchsorted(window_start)) - 1
+    else:
+        state.advance_start(hist_data, window_start)
+
+    fresh = hist_data.iloc[committed + 1:last]
+    for when, close, high, low in zip(fresh.index, fresh['Close'].to_numpy(dtype=np.float64),
+                                      fresh['High'].to_numpy(dtype=np.float64),
+                                      fresh['Low'].to_numpy(dtype=np.float64)):
+        state.push(when, close, high, low)
+
+    path = _indicator_state_file(ticker, period, interval)
+    try:
+        with open(path + '.tmp', 'w', encoding="utf-8") as state_file:
+            json.dump(state.to_dict(), state_file)
+        os.replace(path + '.tmp', path)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not update indicator state for %s: %s", ticker, str(e))
+
+def incremental_metrics(ticker: str, hist_data: pd.DataFrame, period: str,
+                        interval: str = '1d'):
+    """Return the ticker's summary metrics from its indicator state, or None
+
+    The state must cover exactly hist_data minus its last bar, which is
+    folded in here; otherwise the caller falls back to the full computation.
+    """
+    if (not CONFIG.get('use_cache', True) or not CONFIG.get('incremental_indicators', True)
+            or hist_data is None or len(hist_data) < 2):
+        return None
+    state = load_indicator_state(ticker, period, interval)
+    dates = hist_data.index
+    close = history_column(hist_data, 'Close')
+    committed = np.flatnonzero(~np.isnan(close[:-1]))
+    if (state is None or np.isnan(close[-1])
+            or state.last_committed != dates[-2]
+            or state.first_bar != (dates[committed[0]] if len(committed) else None)):
+        return None
+    return state.metrics(dates[-1], float(close[-1]),
+                         float(history_column(hist_data, 'High')[-1]),
+                         float(history_column(hist_data, 'Low')[-1]))
+
+def fetch_history(ticker: str, period: str, interval: str = '1d') -> PriceBars:
+    """Fetch price history for one ticker as PriceBars, refreshing the local cache incrementally"""
+    cached = load_cached_history(ticker, period, interval)
+    if cached is not None:
+        cached_data, cached_start = cached
+        # Re-request the last cached bar's day too, it may have been incomplete when stored
+        new_data = prepare_history(request_history_windows(
+            ticker, interval, start=cached_data.index[-1].date()), interval)
+        if not has_corporate_action(cached_data, new_data):
+            merged = merge_history(cached_data, new_data)
+            save_cached_history(ticker, merged, cached_start, interval)
+            if interval == '1d':
+                update_indicator_state(ticker, merged, period)
+            return price_bars(slice_to_period(merged, period, interval))
+        logger.info("Corporate action for %s, refreshing full history", ticker)
+
+    hist_data = prepare_history(request_history_windows(ticker, interval, period=period),
+                                interval)
+    if not hist_data.empty:
+        save_cached_history(ticker, hist_data, cache_period_start(period, interval), interval)
+        if interval == '1d':
+            update_indicator_state(ticker, hist_data, period)
+    return price_bars(slice_to_period(hist_data, period, interval))
+
+def load_cached_fundamental(ticker: str, data_type: str):
+    """Return cached raw data for a fundamentals data type if it is within its TTL"""
+    if not CONFIG.get('use_cache', True) or CONFIG.get('refresh'):
+        return None
+    ttl_days = CONFIG.get('fundamentals_ttl_days', {}).get(data_type, 1)
+    path = cache_path('fundamentals', ticker, f"{data_type}.pkl")
+    try:
+        age_seconds = datetime.now().timestamp() - os.path.getmtime(path)
+        if age_seconds > ttl_days * 86400:
+            return None
+        return pd.read_pickle(path)
+    except (OSError, ValueError, EOFError, ImportError) as e:
+        if not isinstance(e, FileNotFoundError):
+            logger.debug("Ignoring %s cache for %s: %s", data_type, ticker, str(e))
+        return None
+
+def save_cached_fundamental(ticker: str, data_type: str, data):
+    """Store raw data for a fundamentals data type in the cache"""
+    if not CONFIG.get('use_cache', True) or data is None:
+        return
+    path = cache_path('fundamentals', ticker, f"{data_type}.pkl")
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pd.to_pickle(data, path + '.tmp')
+        os.replace(path + '.tmp', path)
+    except (OSError, ValueError, TypeError) as e:
+        logger.warning("Could not cache %s for %s: %s", data_type, ticker, str(e))
+
+_negative_cache_lock = threading.Lock()
+
+def _negative_cache_path() -> str:
+    return cache_path('invalid_tickers.json')
+
+def load_negative_cache() -> dict:
+    """Return known-invalid tickers mapped to the time their entry expires"""
+    try:
+        with open(_negative_cache_path(), 'r', encoding="utf-8") as cache_file:
+            entries = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(entries, dict):
+        return {}
+    now = datetime.now()
+    valid = {}
+    for ticker, expires in entries.items():
+        # A malformed or hand-edited entry is dropped rather than failing the run
+        try:
+            if datetime.fromisoformat(expires) > now:
+                valid[ticker] = expires
+        except (TypeError, ValueError):
+            logger.debug("Ignoring invalid ticker cache entry for %s: %r", ticker, expires)
+    return valid
+
+def mark_invalid_tickers(tickers: list):
+    """Record tickers without data so later runs skip them until the entry expires"""
+    if not CONFIG.get('use_cache', True) or not tickers:
+        return
+    expires = datetime.now() + pd.Timedelta(days=CONFIG.get('negative_cache_days', 7))
+    with _negative_cache_lock:
+        entries = load_negative_cache()
+        entries.update({ticker: expires.isoformat() for ticker in tickers})
+        try:
+            os.makedirs(os.path.dirname(_negative_cache_path()), exist_ok=True)
+            with open(_negative_cache_path(), 'w', encoding="utf-8") as cache_file:
+                json.dump(entries, cache_file, indent=2)
+        except OSError as e:
+            logger.warning("Could not update invalid ticker cache: %s", str(e))
+
+def load_histories(tickers: list, period: str, batch_size: int, interval: str = '1d') -> dict:
+    """Batch-download history for tickers as PriceBars, fetching only new bars for cached ones"""
+    histories = {}
+    full_refresh = []
+    incremental = {}
+    for ticker in tickers:
+        cached = load_cached_history(ticker, period, interval)
+        if cached is None:
+            full_refresh.append(ticker)
+        else:
+            # Group tickers by their last cached day so each group is one request
+            last_day = cached[0].index[-1].date()
+            incremental.setdefault(last_day, {})[ticker] = cached
+
+    for last_day, group in incremental.items():
+        fresh = download_histories(list(group), batch_size, interval, start=last_day)
+        for ticker, (cached_data, cached_start) in group.items():
+            new_data = fresh.get(ticker)
+            if new_data is None:
+                # The request failed or Yahoo left the ticker out; rather than
+                # serving stale cached bars, leave it for the per-ticker fetch
+                continue
+            new_data = prepare_history(new_data, interval)
+            if has_corporate_action(cached_data, new_data):
+                full_refresh.append(ticker)
+                continue
+            merged = merge_history(cached_data, new_data)
+            save_cached_history(ticker, merged, cached_start, interval)
+            if interval == '1d':
+                update_indicator_state(ticker, merged, period)
+            histories[ticker] = price_bars(slice_to_period(merged, period, interval))
+
+    if full_refresh:
+        for ticker, hist_data in download_histories(full_refresh, batch_size, interval,
+                                                    period=period).items():
+            hist_data = prepare_history(hist_data, interval)
+            save_cached_history(ticker, hist_data, cache_period_start(period, interval), interval)
+            if interval == '1d':
+                update_indicator_state(ticker, hist_data, period)
+            histories[ticker] = price_bars(slice_to_period(hist_data, period, interval))
+    return histories
+
+def to_excel_frame(data: pd.DataFrame) -> pd.DataFrame:
+    """Convert datetimes to dates for Excel, once for every workbook the frame goes to"""
+    # A shallow copy is enough: the index and columns are replaced, never written into
+    excel_data = history_frame(data).copy(deep=False)
+    # Intraday bars keep their time of day
+    if (isinstance(excel_data.index, pd.DatetimeIndex)
+            and (excel_data.index == excel_data.index.normalize()).all()):
+        excel_data.index = excel_data.index.date
+
+    datetime_cols = excel_data.select_dtypes(include=['datetime64']).columns
+    for col in datetime_cols:
+        excel_data[col] = excel_data[col].dt.date
+    return excel_data
+
+# Excel writer backends: the two pandas engines, and a row-by-row xlsxwriter
+# writer in constant-memory mode that flushes each row as soon as it is written
+EXCEL_ENGINES = ('openpyxl', 'xlsxwriter', 'streaming')
+
+def _excel_cell(value):
+    """Convert a value to something xlsxwriter can write, blanks for missing values"""
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    if isinstance(value, (str, bool, int, float, datetime, date)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+def _has_time_of_day(values) -> bool:
+    """Check whether datetime values carry a time of day, e.g. intraday bars"""
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        return False
+    values = pd.DatetimeIndex(values).dropna()
+    return bool((values != values.normalize()).any())
+
+def _write_streaming_sheet(workbook, frame: pd.DataFrame, sheet_name: str, index: bool = True):
+    """Write a frame row by row, the only order constant_memory mode supports"""
+    worksheet = workbook.add_worksheet(sheet_name)
+    header = ([frame.index.name] if index else []) + list(frame.columns)
+    worksheet.write_row(0, 0, [_excel_cell(value) for value in header])
+    # The workbook's default date format drops the time, so timed columns get their own
+    columns = ([frame.index] if index else []) + [frame.iloc[:, i] for i in range(frame.shape[1])]
+    timed = [position for position, values in enumerate(columns) if _has_time_of_day(values)]
+    datetime_format = (workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+                       if timed else None)
+    for row_idx, row in enumerate(frame.itertuples(index=index, name=None), 1):
+        cells = [_excel_cell(value) for value in row]
+        worksheet.write_row(row_idx, 0, cells)
+        for position in timed:
+            if cells[position] is not None:
+                worksheet.write_datetime(row_idx, position, cells[position], datetime_format)
+
+@contextlib.contextmanager
+def open_excel_workbook(path: str, engine: str = None):
+    """Open a workbook and yield write_sheet(frame, sheet_name, index=True)
+
+    engine defaults to CONFIG['excel_engine'].
+    """
+    engine = engine or CONFIG.get('excel_engine', 'openpyxl')
+    if engine not in EXCEL_ENGINES:
+        raise ValueError(f"Unknown Excel engine '{engine}', expected one of {EXCEL_ENGINES}")
+    if engine != 'openpyxl' and xlsxwriter is None:
+        raise ImportError(f"The '{engine}' Excel engine requires the xlsxwriter package")
+
+    if engine == 'streaming':
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True,
+                                              'default_date_format': 'yyyy-mm-dd'})
+        try:
+            yield lambda frame, sheet_name, index=True: _write_streaming_sheet(
+                workbook, frame, sheet_name, index)
+        finally:
+            workbook.close()
+        return
+
+    with pd.ExcelWriter(path, engine=engine) as writer:
+        yield lambda frame, sheet_name, index=True: frame.to_excel(
+            writer, sheet_name=sheet_name, index=index)
+
+# Columnar export formats and their file extensions; arrow is the Arrow IPC
+# stream format, feather the Arrow IPC file format
+COLUMNAR_FORMATS = {'parquet': 'parquet', 'feather': 'feather', 'arrow': 'arrows'}
+EXPORT_FORMATS = ('excel',) + tuple(COLUMNAR_FORMATS) + ('sqlite',)
+
+def to_columnar_frame(data: pd.DataFrame, ticker: str) -> pd.DataFrame:
+    """Flatten a frame to the schema shared by all columnar exports
+
+    The first column is Ticker, the index becomes a regular column (Date for
+    time series), column labels become strings and mixed object columns are
+    stored as strings so every format can write them.
+    """
+    frame = data.copy(deep=False)
+    frame.columns = [col.strftime('%Y-%m-%d') if isinstance(col, (datetime, date)) else str(col)
+                     for col in frame.columns]
+    if isinstance(frame.index, pd.DatetimeIndex):
+        frame = frame.rename_axis('Date').reset_index()
+    elif isinstance(frame.index, pd.RangeIndex) and frame.index.name is None:
+        # Positional rows (info) carry no information worth a column
+        frame = frame.reset_index(drop=True)
+    else:
+        frame = frame.rename_axis(frame.index.name or 'Item').reset_index()
+        frame.columns = [str(col) for col in frame.columns]
+
+    for col in [col for col, dtype in frame.dtypes.items() if dtype == object]:
+        frame[col] = frame[col].map(
+            lambda value: value if value is None or isinstance(value, str) else str(value)
+        )
+    frame.insert(0, 'Ticker', ticker)
+    return frame
+
+def export_columnar(data: pd.DataFrame, ticker: str, name: str, ticker_dir: str,
+                    timestamp: str, formats) -> list:
+    """Write data in each requested columnar format and return the paths written"""
+    formats = [fmt for fmt in formats if fmt in COLUMNAR_FORMATS]
+    if not formats:
+        return []
+    if pa is None:
+        raise ImportError("Columnar export formats require the pyarrow package")
+
+    compression = CONFIG.get('columnar_compression', 'zstd')
+    frame = to_columnar_frame(history_frame(data), ticker)
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    paths = []
+    for fmt in formats:
+        path = os.path.join(ticker_dir, f"{ticker}_{name}_{timestamp}.{COLUMNAR_FORMATS[fmt]}")
+        if fmt == 'parquet':
+            pa.parquet.write_table(table, path, compression=compression)
+        elif fmt == 'feather':
+            pa.feather.write_feather(table, path, compression=compression)
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=compression)
+            with pa.OSFile(path, 'wb') as sink:
+                with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+                    writer.write_table(table)
+        paths.append(path)
+    return paths
+
+# Embedded SQL warehouse: one table per kind of data, keyed so re-running a
+# ticker overwrites its rows instead of duplicating them
+WAREHOUSE_TABLES = {
+    'history': (('ticker', 'date', 'open', 'high', 'low', 'close', 'volume',
+                 'dividends', 'stock_splits'), ('ticker', 'date')),
+    'fundamentals': (('ticker', 'data_type', 'period', 'item', 'value'),
+                     ('ticker', 'data_type', 'period', 'item')),
+    'history_intraday': (('ticker', 'interval', 'date', 'open', 'high', 'low', 'close',
+                          'volume', 'dividends', 'stock_splits'), ('ticker', 'interval', 'date')),
+    'summaries': (('ticker', 'date', 'metric', 'value'), ('ticker', 'date', 'metric'))
+}
+_warehouse_lock = threading.Lock()
+
+def warehouse_path(output_dir: str) -> str:
+    """Return the warehouse database file for an output directory"""
+    return CONFIG.get('warehouse_path') or os.path.join(output_dir, 'warehouse.sqlite')
+
+def _sql_value(value):
+    """Convert a cell to a type sqlite3 can bind, None for missing values"""
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (datetime, date)):
+        return _sql_date(value)
+    if isinstance(value, (str, int, float)):
+        return value
+    return str(value)
+
+def _sql_date(value) -> str:
+    """Format a timestamp as ISO text, date-only at midnight so daily keys stay short"""
+    value = pd.Timestamp(value)
+    return value.strftime('%Y-%m-%d') if value == value.normalize() else value.isoformat(' ')
+
+def warehouse_rows(data: pd.DataFrame, ticker: str, name: str, as_of) -> tuple:
+    """Turn history, a data type or a summary into (table, rows) for the warehouse
+
+    A summary is a Series of numeric metric values keyed by metric name.
+    """
+    if name == 'historical' or name.startswith('historical_'):
+        # Intraday bars ('historical_<interval>') go to their own table keyed by interval
+        key = (ticker,) if name == 'historical' else (ticker, name[len('historical_'):])
+        columns = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+        frame = history_frame(data).reindex(columns=columns)
+        # Rows are generated while they are inserted rather than held all at once
+        rows = ((*key, _sql_date(when), *(_sql_value(value) for value in values))
+                for when, values in zip(frame.index, frame.itertuples(index=False, name=None)))
+        return ('history' if name == 'historical' else 'history_intraday'), rows
+
+    if name == 'summary':
+        rows = [(ticker, _sql_date(as_of), metric, _sql_value(value))
+                for metric, value in data.items()]
+        return 'summaries', rows
+
+    if len(data.columns) and all(isinstance(col, (datetime, date)) for col in data.columns):
+        # Statements: line items by reporting period
+        cells = ((period, item, value) for item, values in data.iterrows()
+                 for period, value in values.items())
+    elif isinstance(data.index, pd.DatetimeIndex):
+        # Event series such as dividends and splits
+        cells = ((when, col, value) for col in data.columns
+                 for when, value in data[col].items())
+    else:
+        # Snapshot records such as info, dated by the run
+        cells = ((as_of, col, value) for _, record in data.iterrows()
+                 for col, value in record.items())
+    rows = [(ticker, name, _sql_date(period), str(item), _sql_value(value))
+            for period, item, value in cells]
+    return 'fundamentals', rows
+
+def upsert_warehouse(path: str, table: str, rows: list):
+    """Insert rows into a warehouse table, replacing rows with the same key"""
+    columns, key = WAREHOUSE_TABLES[table]
+    updates = ', '.join(f"{col} = excluded.{col}" for col in columns if col not in key)
+    statement = (f"INSERT INTO {table} ({', '.join(columns)}) "
+                 f"VALUES ({', '.join('?' for _ in columns)}) "
+                 f"ON CONFLICT ({', '.join(key)}) DO UPDATE SET {updates}")
+    with _warehouse_lock:
+        connection = sqlite3.connect(path, timeout=30)
+        try:
+            with connection:
+                connection.execute("PRAGMA journal_mode=WAL")
+                for table_name, (table_columns, table_key) in WAREHOUSE_TABLES.items():
+                    connection.execute(
+                        f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(table_columns)}, "
+                        f"PRIMARY KEY ({', '.join(table_key)}))"
+                    )
+                connection.executemany(statement, rows)
+        finally:
+            connection.close()
+
 def safe_input(prompt):
     """Get user input safely, allowing exit"""
     value = input(prompt)
@@ -166,99 +1760,791 @@ def select_data_types():
         print("Invalid selection, defaulting to all data types")
         return list(DATA_TYPE_DESCRIPTIONS.keys())
 
-def create_price_chart(hist_data: pd.DataFrame, ticker: str, save_path: str):
-    """Create and save candlestick chart with color-coded volume"""
-    style = mpf.make_mpf_style(
-        base_mpf_style=CONFIG['chart_settings']['style'],
-        marketcolors=mpf.make_marketcolors(
-            up=CONFIG['chart_settings']['colors']['up'],
-            down=CONFIG['chart_settings']['colors']['down'],
-            edge='inherit',
-            wick='inherit',
-            volume='inherit'
-        ),
-        gridstyle=':',
-        gridcolor='#404040',
-        facecolor=CONFIG['chart_settings']['background'],
-        figcolor=CONFIG['chart_settings']['background'],
-        rc={'axes.labelcolor': 'white',
-            'axes.edgecolor': 'white',
-            'xtick.color': 'white',
-            'ytick.color': 'white'})
+def build_chart_style(chart_settings: dict):
+    """Build the mplfinance style for chart_settings, reusing it across charts"""
+    key = json.dumps(chart_settings, sort_keys=True)
+    if key not in _chart_styles:
+        _chart_styles[key] = mpf.make_mpf_style(
+            base_mpf_style=chart_settings['style'],
+            marketcolors=mpf.make_marketcolors(
+                up=chart_settings['colors']['up'],
+                down=chart_settings['colors']['down'],
+                edge='inherit',
+                wick='inherit',
+                volume='inherit'
+            ),
+            gridstyle=':',
+            gridcolor='#404040',
+            facecolor=chart_settings['background'],
+            figcolor=chart_settings['background'],
+            rc={'axes.labelcolor': 'white',
+                'axes.edgecolor': 'white',
+                'xtick.color': 'white',
+                'ytick.color': 'white'})
+    return _chart_styles[key]
+
+def choose_bar_rule(index: pd.DatetimeIndex, max_bars: int):
+    """Return the finest resample rule that fits index into max_bars, or None if it fits"""
+    if len(index) <= max_bars:
+        return None
+    spacing = pd.Series(index).diff().median()
+    rule = None
+    for rule, length in CHART_BAR_RULES.items():
+        if length <= spacing:
+            continue
+        bins = pd.Series(1, index=index).resample(rule).count()
+        if (bins > 0).sum() <= max_bars:
+            return rule
+    return rule
+
+def aggregate_ohlcv(hist_data, rule: str, extra: pd.DataFrame = None) -> pd.DataFrame:
+    """Aggregate OHLCV bars to rule, labelled by the first bar of each period
+
+    Only bar positions are resampled: each period runs from its first to its
+    last bar with a close, and highs, lows and volumes are reduced over the
+    column arrays in between. Any other column, and the columns of extra
+    (aligned with hist_data, such as indicators), take their value at the
+    period's last bar. Periods without trading (weekends, holidays) are dropped.
+    """
+    with_close = np.flatnonzero(~np.isnan(history_column(hist_data, 'Close')))
+    periods = pd.Series(with_close, index=hist_data.index[with_close]).resample(rule)
+    starts = periods.first().dropna().to_numpy(dtype=np.int64)
+    ends = periods.last().dropna().to_numpy(dtype=np.int64)
+    reducers = {'High': np.fmax, 'Low': np.fmin}
+    columns = {}
+    for col in hist_data.columns:
+        values = history_column(hist_data, col, None)
+        if col == 'Open':
+            columns[col] = values[starts]
+        elif col in reducers:
+            columns[col] = reducers[col].reduceat(values, starts) if len(starts) else values[:0]
+        elif col == 'Volume':
+            volume = np.nan_to_num(values.astype(np.float64))
+            columns[col] = np.add.reduceat(volume, starts) if len(starts) else volume[:0]
+        else:
+            columns[col] = values[ends]
+    if extra is not None:
+        for col in extra.columns:
+            columns[col] = extra[col].to_numpy()[ends]
+    return pd.DataFrame(columns, index=pd.DatetimeIndex(hist_data.index[starts],
+                                                        name=hist_data.index.name))
+
+def indicator_addplots(bars: pd.DataFrame, overlays) -> tuple:
+    """Build mplfinance addplots for the overlays found in bars and their panel ratios
+
+    Bollinger Bands share the price panel; RSI and MACD get a panel each below volume.
+    """
+    def has(*columns):
+        return all(col in bars.columns and bars[col].notna().any() for col in columns)
+
+    addplots = []
+    panel_ratios = [2, 1]
+    if 'bollinger' in overlays and has('bb_upper', 'bb_lower'):
+        addplots += [mpf.make_addplot(bars[col], panel=0, color='#9e9e9e', width=0.8,
+                                      secondary_y=False)
+                     for col in ('bb_upper', 'bb_lower')]
+    if 'rsi' in overlays and has('rsi_14'):
+        addplots.append(mpf.make_addplot(bars['rsi_14'], panel=len(panel_ratios),
+                                         color='#ffb74d', ylabel='RSI', ylim=(0, 100)))
+        panel_ratios.append(0.7)
+    if 'macd' in overlays and has('macd', 'macd_signal', 'macd_hist'):
+        panel = len(panel_ratios)
+        addplots += [
+            mpf.make_addplot(bars['macd_hist'], panel=panel, type='bar', color='#607d8b',
+                             ylabel='MACD', secondary_y=False),
+            mpf.make_addplot(bars['macd'], panel=panel, color='#4fc3f7', width=0.8,
+                             secondary_y=False),
+            mpf.make_addplot(bars['macd_signal'], panel=panel, color='#f06292', width=0.8,
+                             secondary_y=False)
+        ]
+        panel_ratios.append(0.7)
+    return addplots, tuple(panel_ratios)
+
+def create_price_chart(hist_data: pd.DataFrame, ticker: str, save_path: str,
+                       chart_settings: dict = None, indicators: pd.DataFrame = None):
+    """Create and save candlestick chart with color-coded volume
+
+    indicators, as returned by compute_indicators for hist_data, adds the
+    overlays listed in chart_settings['indicators'].
+    """
+    chart_settings = chart_settings or CONFIG['chart_settings']
+    style = build_chart_style(chart_settings)
+    overlays = chart_settings.get('indicators', DEFAULT_CHART_INDICATORS)
+    if indicators is not None:
+        # Only the plotted indicator columns travel with the bars
+        indicators = indicators[[col for overlay in overlays
+                                 for col in CHART_OVERLAY_COLUMNS.get(overlay, ())
+                                 if col in indicators.columns]]
+
+    # Keep the candle count, and so render time, bounded for long histories
+    max_bars = chart_settings.get(
+        'max_candles', CHART_FIGSIZE[0] * chart_settings['dpi'] // PIXELS_PER_CANDLE
+    )
+    title = f'\n{ticker} Stock Analysis'
+    rule = choose_bar_rule(hist_data.index, max_bars)
+    if rule is not None:
+        # Aggregate straight from the arrays; only the aggregated bars become a frame
+        hist_data = aggregate_ohlcv(hist_data, rule, indicators)
+        title += f" ({CHART_BAR_LABELS.get(rule, rule)} bars)"
+    else:
+        hist_data = history_frame(hist_data)
+        if indicators is not None:
+            hist_data = hist_data.join(indicators, how='left')
+    addplots, panel_ratios = indicator_addplots(hist_data, overlays)
 
     mpf.plot(hist_data,
             type='candle',
-            title=f'\n{ticker} Stock Analysis',
+            title=title,
             volume=True,
             style=style,
-            figsize=(15, 10),
-            panel_ratios=(2, 1),
+            figsize=CHART_FIGSIZE,
+            panel_ratios=panel_ratios,
+            addplot=addplots,
             savefig=dict(
                 fname=save_path,
-                dpi=CONFIG['chart_settings']['dpi'],
+                dpi=chart_settings['dpi'],
                 bbox_inches='tight',
-                facecolor=CONFIG['chart_settings']['background']
+                facecolor=chart_settings['background']
             ))
 
-def analyze_stock_data(hist_data: pd.DataFrame) -> pd.DataFrame:
-    """Calculate key statistics and metrics"""
-    latest_price = hist_data['Close'].iloc[-1]
-    high_52w = hist_data['High'].tail(252).max()
-    low_52w = hist_data['Low'].tail(252).min()
+def init_chart_worker(chart_settings: dict):
+    """Warm up a chart process: select Agg, build the style and load fonts once"""
+    matplotlib.use('Agg')
+    sample = pd.DataFrame(
+        {'Open': [1.0, 2.0], 'High': [2.0, 3.0], 'Low': [0.5, 1.5],
+         'Close': [1.5, 2.5], 'Volume': [100, 200]},
+        index=pd.date_range('2000-01-03', periods=2)
+    )
+    mpf.plot(sample, type='candle', volume=True, style=build_chart_style(chart_settings),
+             savefig=io.BytesIO())
+
+def render_chart(hist_data: pd.DataFrame, ticker: str, save_path: str,
+                 chart_settings: dict, indicators: pd.DataFrame = None) -> str:
+    """Chart job run inside a chart process pool worker"""
+    create_price_chart(hist_data, ticker, save_path, chart_settings, indicators)
+    return save_path
+
+def start_chart_pool(chart_workers: int) -> ProcessPoolExecutor:
+    """Start a pool of warm chart rendering processes"""
+    pool = ProcessPoolExecutor(max_workers=chart_workers, initializer=init_chart_worker,
+                               initargs=(CONFIG['chart_settings'],))
+    # Launch every worker now so the warm-up overlaps with the downloads
+    for _ in range(chart_workers):
+        pool.submit(os.getpid)
+    return pool
+
+# Cross-sectional metric columns and the summary labels they are reported under
+SUMMARY_METRICS = {
+    'price': 'Current Price',
+    'high_52w': '52-Week High',
+    'low_52w': '52-Week Low',
+    'dist_52w_high_pct': 'Distance from 52w High',
+    'dist_52w_low_pct': 'Distance from 52w Low',
+    'ma_50': '50-Day MA',
+    'ma_200': '200-Day MA',
+    'volatility_pct': 'Volatility (Annualized)',
+    'return_1m_pct': 'Return (1-Month)',
+    'return_ytd_pct': 'Return (YTD)'
+}
+# Intraday bars are summarized on daily aggregates plus these session metrics
+INTRADAY_METRICS = {
+    'session_vwap': 'Session VWAP',
+    'session_return_pct': 'Session Return',
+    'intraday_volatility_pct': 'Intraday Volatility (Annualized)',
+    'avg_range_pct': 'Average Daily Range',
+    'bars_per_session': 'Bars per Session'
+}
+PERCENT_METRICS = {'dist_52w_high_pct', 'dist_52w_low_pct', 'volatility_pct',
+                   'return_1m_pct', 'return_ytd_pct', 'session_return_pct',
+                   'intraday_volatility_pct', 'avg_range_pct'}
+
+def build_price_panel(histories: dict, fields=('Close', 'High', 'Low')) -> tuple:
+    """Align histories on the union of their dates as (dates, tickers, *field panels)
+
+    The default fields give (dates, tickers, closes, highs, lows). The price
+    arrays are float64 with one column per ticker and NaN where a ticker has no bar.
+    """
+    tickers = list(histories)
+    dates = pd.DatetimeIndex([])
+    for hist_data in histories.values():
+        dates = dates.union(hist_data.index)
+    panels = []
+    for field in fields:
+        panel = np.full((len(dates), len(tickers)), np.nan)
+        for col_idx, ticker in enumerate(tickers):
+            rows = dates.get_indexer(histories[ticker].index)
+            panel[rows, col_idx] = history_column(histories[ticker], field)
+        panels.append(panel)
+    return (dates, tickers, *panels)
+
+def _last_rows(mask: np.ndarray) -> np.ndarray:
+    """Row of the last True per column, -1 where a column has none"""
+    rows = np.arange(mask.shape[0])[:, None]
+    return np.where(mask, rows, -1).max(axis=0)
+
+def panel_returns(closes: np.ndarray) -> np.ndarray:
+    """Daily returns per column against that ticker's previous bar, NaN where it has none
+
+    Rows a ticker has no bar on are skipped rather than breaking its return series.
+    """
+    num_rows, num_cols = closes.shape
+    valid = ~np.isnan(closes)
+    filled_rows = np.maximum.accumulate(np.where(valid, np.arange(num_rows)[:, None], 0), axis=0)
+    previous = np.full_like(closes, np.nan)
+    previous[1:] = closes[filled_rows[:-1], np.arange(num_cols)]
+    return np.where(valid, closes / previous - 1, np.nan)
+
+def analyze_panel(dates: pd.DatetimeIndex, tickers: list, closes: np.ndarray,
+                  highs: np.ndarray, lows: np.ndarray) -> pd.DataFrame:
+    """Compute the summary metrics for every ticker of a price panel in one NumPy pass
+
+    Each column is treated like that ticker's own history: windows count the
+    ticker's bars rather than panel rows. Returns a frame indexed by ticker with
+    the SUMMARY_METRICS columns (percent metrics in percent) and last_date.
+    """
+    num_rows, num_cols = closes.shape
+    cols = np.arange(num_cols)
+    valid = ~np.isnan(closes)
+    # Bars at or after each row, per ticker; <= n marks the ticker's last n bars
+    bars_from_end = np.cumsum(valid[::-1], axis=0)[::-1]
+
+    last_row = _last_rows(valid)
+    has_data = last_row >= 0
+    last_row = np.where(has_data, last_row, 0)
+    price = np.where(has_data, closes[last_row, cols], np.nan)
+
+    in_52w = valid & (bars_from_end <= 252)
+    high_52w = np.where(in_52w, highs, -np.inf).max(axis=0, initial=-np.inf)
+    low_52w = np.where(in_52w, lows, np.inf).min(axis=0, initial=np.inf)
+    high_52w[~np.isfinite(high_52w)] = np.nan
+    low_52w[~np.isfinite(low_52w)] = np.nan
+
+    def moving_average(window):
+        in_window = valid & (bars_from_end <= window)
+        total = np.where(in_window, closes, 0.0).sum(axis=0)
+        return np.where(in_window.sum(axis=0) == window, total / window, np.nan)
+
+    returns = panel_returns(closes)
+    return_mask = ~np.isnan(returns)
+    return_count = return_mask.sum(axis=0)
+    mean_return = np.where(return_mask, returns, 0.0).sum(axis=0) / np.maximum(return_count, 1)
+    squared = np.where(return_mask, (returns - mean_return) ** 2, 0.0).sum(axis=0)
+    volatility = np.where(return_count > 1,
+                          np.sqrt(squared / np.maximum(return_count - 1, 1)) * 252 ** 0.5,
+                          np.nan)
+
+    # 1-month return: last close against the last close of the previous calendar month
+    month_ids = (dates.year * 12 + dates.month).to_numpy()
+    prev_month_row = _last_rows(valid & (month_ids[:, None] == month_ids[last_row] - 1))
+    prev_month_close = np.where(prev_month_row >= 0,
+                                closes[np.maximum(prev_month_row, 0), cols], np.nan)
+
+    # YTD return: last close against the first close of the current year
+    in_year = valid & (dates.year.to_numpy()[:, None] == datetime.now().year)
+    first_year_row = np.where(in_year, np.arange(num_rows)[:, None], num_rows).min(axis=0)
+    ytd_start = np.where(first_year_row < num_rows,
+                         closes[np.minimum(first_year_row, num_rows - 1), cols], np.nan)
 
-    daily_returns = hist_data['Close'].pct_change()
-    monthly_returns = hist_data['Close'].resample('ME').last().pct_change()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics = {
+            'price': price,
+            'high_52w': high_52w,
+            'low_52w': low_52w,
+            'dist_52w_high_pct': (price / high_52w - 1) * 100,
+            'dist_52w_low_pct': (price / low_52w - 1) * 100,
+            'ma_50': moving_average(50),
+            'ma_200': moving_average(200),
+            'volatility_pct': volatility * 100,
+            'return_1m_pct': (price / prev_month_close - 1) * 100,
+            'return_ytd_pct': (price / ytd_start - 1) * 100
+        }
+    cross_section = pd.DataFrame(metrics, index=pd.Index(tickers, name='Ticker'))
+    cross_section['last_date'] = dates[last_row].where(has_data)
+    return cross_section
 
-    ytd_start_price = hist_data['Close'].loc[str(datetime.now().year)].iloc[0]
-    ytd_return = (latest_price / ytd_start_price - 1) * 100
+def format_summary(metrics, labels: dict = None) -> pd.DataFrame:
+    """Turn one ticker's cross-sectional metrics into the Metric/Value summary table"""
     analysis = {
-        'Current Price': latest_price,
-        '52-Week High': high_52w,
-        '52-Week Low': low_52w,
-        'Distance from 52w High': f"{((latest_price / high_52w) - 1) * 100:.1f}%",
-        'Distance from 52w Low': f"{((latest_price / low_52w) - 1) * 100:.1f}%",
-        '50-Day MA': hist_data['Close'].rolling(window=50).mean().iloc[-1],
-        '200-Day MA': hist_data['Close'].rolling(window=200).mean().iloc[-1],
-        'Volatility (Annualized)': f"{(daily_returns.std() * (252 ** 0.5)) * 100:.1f}%",
-        'Return (1-Month)': f"{monthly_returns.iloc[-1] * 100:.1f}%",
-        'Return (YTD)': f"{ytd_return:.1f}%"
+        label: f"{metrics[key]:.1f}%" if key in PERCENT_METRICS else metrics[key]
+        for key, label in (labels or SUMMARY_METRICS).items()
     }
-
     return pd.DataFrame(analysis.items(), columns=['Metric', 'Value'])
 
-@retry(stop=stop_after_attempt(CONFIG['retries']),
-       wait=wait_exponential(multiplier=1, min=4, max=10))
+def summarize_universe(histories: dict, period: str = None) -> tuple:
+    """Return (per-ticker summary tables, cross-sectional frame) for many histories
+
+    With period, tickers whose cached indicator state matches their history
+    take their metrics from it and only the rest go through the panel pass.
+    """
+    if not histories:
+        return {}, pd.DataFrame(columns=list(SUMMARY_METRICS) + ['last_date'])
+    cached = {}
+    if period is not None:
+        for ticker, hist_data in histories.items():
+            metrics = incremental_metrics(ticker, hist_data, period)
+            if metrics is not None:
+                cached[ticker] = metrics
+    remaining = {ticker: hist_data for ticker, hist_data in histories.items()
+                 if ticker not in cached}
+    cross_section = analyze_panel(*build_price_panel(remaining)) if remaining else None
+    if cached:
+        cached_section = pd.DataFrame.from_dict(cached, orient='index')
+        cached_section['last_date'] = pd.to_datetime(cached_section['last_date'])
+        cross_section = pd.concat([frame for frame in (cross_section, cached_section)
+                                   if frame is not None])
+        cross_section = cross_section.reindex(list(histories)).rename_axis('Ticker')
+    summaries = {ticker: format_summary(metrics) for ticker, metrics in cross_section.iterrows()}
+    return summaries, cross_section
+
+def daily_bars(hist_data: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate intraday bars to one OHLCV bar per session, labelled by its date"""
+    bars = aggregate_ohlcv(
+        history_frame(hist_data).reindex(columns=['Open', 'High', 'Low', 'Close', 'Volume']), 'D')
+    bars.index = bars.index.normalize()
+    return bars
+
+def intraday_metrics(hist_data: pd.DataFrame) -> pd.Series:
+    """Session metrics for intraday bars: VWAP, return, realized volatility and range
+
+    The VWAP and return are for the latest session; volatility is annualized
+    from bar-to-bar returns within sessions, so overnight gaps are left out.
+    """
+    hist_data = history_frame(hist_data)
+    bars = hist_data[hist_data['Close'].notna().to_numpy()]
+    if bars.empty:
+        return pd.Series(np.nan, index=list(INTRADAY_METRICS))
+    close = bars['Close'].to_numpy(dtype=np.float64)
+    sessions = bars.index.normalize()
+    latest = sessions == sessions[-1]
+
+    typical = (bars['High'].to_numpy(dtype=np.float64) + bars['Low'].to_numpy(dtype=np.float64)
+               + close)[latest] / 3
+    volume = np.nan_to_num(bars['Volume'].to_numpy(dtype=np.float64))[latest]
+    session_vwap = (typical * volume).sum() / volume.sum() if volume.sum() > 0 else np.nan
+    reference = close[~latest][-1] if (~latest).any() else float(bars['Open'].iloc[0])
+
+    bars_per_session = float(np.median(np.unique(sessions, return_counts=True)[1]))
+    within_session = (sessions[1:] == sessions[:-1])
+    log_returns = np.diff(np.log(close))[within_session]
+    volatility = (log_returns.std(ddof=1) * np.sqrt(bars_per_session * 252) * 100
+                  if len(log_returns) > 1 else np.nan)
+
+    daily = daily_bars(bars)
+    return pd.Series({
+        'session_vwap': session_vwap,
+        'session_return_pct': (close[-1] / reference - 1) * 100,
+        'intraday_volatility_pct': volatility,
+        'avg_range_pct': ((daily['High'] - daily['Low']) / daily['Close']).mean() * 100,
+        'bars_per_session': bars_per_session
+    })
+
+def analyze_stock_data(hist_data: pd.DataFrame) -> pd.DataFrame:
+    """Calculate key statistics and metrics"""
+    return summarize_universe({'': hist_data})[0]['']
+
+# Technical indicators, computed on NumPy arrays of the bars with a close.
+# Each function takes the OHLCV arrays and returns its named output columns.
+RSI_PERIOD = 14
+MACD_SPANS = (12, 26, 9)
+BOLLINGER_WINDOW, BOLLINGER_WIDTH = 20, 2
+ATR_PERIOD = 14
+STOCHASTIC_PERIODS = (14, 3)
+VWAP_WINDOW = 20
+
+def _ema(values: np.ndarray, alpha: float, min_periods: int = 0) -> np.ndarray:
+    """Recursive exponential moving average, seeded with the first value"""
+    return pd.Series(values).ewm(alpha=alpha, adjust=False,
+                                 min_periods=min_periods).mean().to_numpy()
+
+def _rolling(values: np.ndarray, window: int, how: str, **kwargs) -> np.ndarray:
+    """Trailing-window mean, sum, std, min or max in O(n), NaN until the first full window"""
+    return getattr(pd.Series(values).rolling(window), how)(**kwargs).to_numpy()
+
+def _rsi(close, **_):
+    delta = np.diff(close, prepend=np.nan)
+    alpha = 1 / RSI_PERIOD
+    avg_gain = _ema(np.clip(delta, 0, None), alpha, RSI_PERIOD)
+    avg_loss = _ema(np.clip(-delta, 0, None), alpha, RSI_PERIOD)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = np.where(avg_loss == 0, 100.0, 100 - 100 / (1 + avg_gain / avg_loss))
+    return {'rsi_14': np.where(np.isnan(avg_gain), np.nan, rsi)}
+
+def _macd(close, **_):
+    fast, slow, signal = MACD_SPANS
+    macd = _ema(close, 2 / (fast + 1)) - _ema(close, 2 / (slow + 1))
+    macd_signal = _ema(macd, 2 / (signal + 1))
+    return {'macd': macd, 'macd_signal': macd_signal, 'macd_hist': macd - macd_signal}
+
+def _bollinger(close, **_):
+    middle = _rolling(close, BOLLINGER_WINDOW, 'mean')
+    band = BOLLINGER_WIDTH * _rolling(close, BOLLINGER_WINDOW, 'std', ddof=0)
+    return {'bb_middle': middle, 'bb_upper': middle + band, 'bb_lower': middle - band}
+
+def _atr(high, low, close, **_):
+    prev_close = np.concatenate(([np.nan], close[:-1]))
+    true_range = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+    return {'atr_14': _ema(true_range, 1 / ATR_PERIOD, ATR_PERIOD)}
+
+def _stochastic(high, low, close, **_):
+    k_period, d_period = STOCHASTIC_PERIODS
+    lowest = _rolling(low, k_period, 'min')
+    highest = _rolling(high, k_period, 'max')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stoch_k = np.where(highest > lowest, (close - lowest) / (highest - lowest) * 100, 50.0)
+    stoch_k[np.isnan(lowest)] = np.nan
+    return {'stoch_k': stoch_k, 'stoch_d': _rolling(stoch_k, d_period, 'mean')}
+
+def _obv(close, volume, **_):
+    direction = np.sign(np.diff(close, prepend=close[:1]))
+    return {'obv': np.cumsum(direction * volume)}
+
+def _vwap(high, low, close, volume, **_):
+    typical_volume = _rolling((high + low + close) / 3 * volume, VWAP_WINDOW, 'sum')
+    total_volume = _rolling(volume, VWAP_WINDOW, 'sum')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {'vwap_20': np.where(total_volume > 0, typical_volume / total_volume, np.nan)}
+
+INDICATORS = {
+    'rsi': _rsi,
+    'macd': _macd,
+    'bollinger': _bollinger,
+    'atr': _atr,
+    'stochastic': _stochastic,
+    'obv': _obv,
+    'vwap': _vwap
+}
+
+# Latest indicator values added to the summary table
+INDICATOR_METRICS = {
+    'rsi_14': 'RSI (14)',
+    'macd': 'MACD (12, 26)',
+    'macd_signal': 'MACD Signal (9)',
+    'bb_upper': 'Bollinger Upper (20, 2)',
+    'bb_lower': 'Bollinger Lower (20, 2)',
+    'atr_14': 'ATR (14)',
+    'stoch_k': 'Stochastic %K (14)',
+    'stoch_d': 'Stochastic %D (3)',
+    'obv': 'On-Balance Volume',
+    'vwap_20': 'VWAP (20)'
+}
+
+def indicator_arrays(hist_data: pd.DataFrame) -> dict:
+    """Return float64 OHLCV arrays of the bars with a close, missing volume as zero"""
+    valid = ~np.isnan(history_column(hist_data, 'Close'))
+    arrays = {field.lower(): history_column(hist_data, field) for field in ('High', 'Low', 'Close')}
+    arrays['volume'] = (np.nan_to_num(history_column(hist_data, 'Volume'))
+                        if 'Volume' in hist_data.columns else np.zeros(len(valid)))
+    if valid.all():
+        return arrays
+    return {field: values[valid] for field, values in arrays.items()}
+
+def compute_indicators(hist_data) -> pd.DataFrame:
+    """Compute every indicator for a history, one row per bar and NaN during warm-up
+
+    Indicators of float32 bars are stored as float32 too. The frame is built
+    around the computed arrays rather than a consolidated copy of them.
+    """
+    arrays = indicator_arrays(hist_data)
+    dtype = history_column(hist_data, 'Close', None).dtype
+    dtype = np.float32 if dtype == np.float32 else np.float64
+    columns = {}
+    for indicator in INDICATORS.values():
+        for col, values in indicator(**arrays).items():
+            columns[col] = values.astype(dtype, copy=False)
+    valid = ~np.isnan(history_column(hist_data, 'Close'))
+    if valid.all():
+        return pd.DataFrame(columns, index=hist_data.index, copy=False)
+    return pd.DataFrame(columns, index=hist_data.index[valid], copy=False).reindex(hist_data.index)
+
+def _indicator_cache_files(ticker: str, period: str, interval: str = '1d'):
+    base = cache_path('indicators', f"{ticker}_{interval}_{period}")
+    return base + '.parquet', base + '.json'
+
+def _history_fingerprint(hist_data: pd.DataFrame) -> dict:
+    """Identify a history by its length, last bar and last close"""
+    return {'rows': len(hist_data), 'last': hist_data.index[-1].isoformat(),
+            'last_close': float(history_column(hist_data, 'Close')[-1])}
+
+def get_indicators(ticker: str, hist_data: pd.DataFrame, period: str,
+                   interval: str = '1d') -> pd.DataFrame:
+    """Return the ticker's indicators, from the cache when they match hist_data"""
+    use_cache = CONFIG.get('use_cache', True) and not hist_data.empty
+    if use_cache:
+        data_path, meta_path = _indicator_cache_files(ticker, period, interval)
+        fingerprint = _history_fingerprint(hist_data)
+        try:
+            if os.path.exists(data_path) and os.path.exists(meta_path):
+                with open(meta_path, 'r', encoding="utf-8") as meta_file:
+                    cached = json.load(meta_file)
+                if (cached['rows'] == fingerprint['rows'] and cached['last'] == fingerprint['last']
+                        and np.isclose(cached['last_close'], fingerprint['last_close'],
+                                       equal_nan=True)):
+                    return pd.read_parquet(data_path)
+        except (OSError, ValueError, KeyError, ImportError) as e:
+            logger.debug("Ignoring indicator cache for %s: %s", ticker, str(e))
+
+    indicators = compute_indicators(hist_data)
+    if use_cache:
+        try:
+            os.makedirs(os.path.dirname(data_path), exist_ok=True)
+            indicators.to_parquet(data_path + '.tmp')
+            os.replace(data_path + '.tmp', data_path)
+            with open(meta_path, 'w', encoding="utf-8") as meta_file:
+                json.dump(fingerprint, meta_file)
+        except (OSError, ValueError, ImportError) as e:
+            logger.warning("Could not update indicator cache for %s: %s", ticker, str(e))
+    return indicators
+
+def indicator_summary(indicators: pd.DataFrame) -> pd.DataFrame:
+    """Turn the latest indicator values into Metric/Value rows for the summary table"""
+    latest = indicators.iloc[-1] if len(indicators) else pd.Series(dtype=float)
+    return pd.DataFrame([(label, latest.get(key, np.nan))
+                         for key, label in INDICATOR_METRICS.items()],
+                        columns=['Metric', 'Value'])
+
+def blockwise_correlation(returns: np.ndarray, correlation: np.ndarray, covariance: np.ndarray,
+                          observations: np.ndarray, block_size: int = 500,
+                          min_periods: int = 20):
+    """Fill pairwise-complete correlation, covariance and overlap-count matrices
+
+    returns is a dates x tickers array with NaN where a ticker has no return.
+    Each pair uses only the dates both tickers have, through masked matrix
+    products over column blocks, so only block_size x block_size
+    intermediates exist at a time and the outputs can be memory-mapped
+    files. Pairs with fewer than min_periods common returns are NaN.
+    """
+    mask = (~np.isnan(returns)).astype(np.float64)
+    # Centering does not change covariances but keeps the sums well conditioned
+    means = np.nansum(returns, axis=0) / np.maximum(mask.sum(axis=0), 1)
+    values = np.nan_to_num(returns - means, copy=False)
+    num_cols = returns.shape[1]
+    for row_start in range(0, num_cols, block_size):
+        rows = slice(row_start, min(row_start + block_size, num_cols))
+        x_values, x_mask = values[:, rows], mask[:, rows]
+        for col_start in range(row_start, num_cols, block_size):
+            cols = slice(col_start, min(col_start + block_size, num_cols))
+            y_values, y_mask = values[:, cols], mask[:, cols]
+            count = x_mask.T @ y_mask
+            sum_x = x_values.T @ y_mask
+            sum_y = x_mask.T @ y_values
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean_x, mean_y = sum_x / count, sum_y / count
+                cov = (x_values.T @ y_values - sum_x * mean_y) / (count - 1)
+                var_x = ((x_values ** 2).T @ y_mask - sum_x * mean_x) / (count - 1)
+                var_y = (x_mask.T @ y_values ** 2 - sum_y * mean_y) / (count - 1)
+                corr = np.clip(cov / np.sqrt(var_x * var_y), -1, 1)
+            enough = count >= max(min_periods, 2)
+            cov = np.where(enough, cov, np.nan)
+            corr = np.where(enough, corr, np.nan)
+            for target, block in ((correlation, corr), (covariance, cov),
+                                  (observations, count.astype(observations.dtype))):
+                target[rows, cols] = block
+                target[cols, rows] = block.T
+
+# Backtest strategies and their default parameter grids
+BACKTEST_GRIDS = {
+    'ma_crossover': {'fast': [5, 10, 20, 50], 'slow': [50, 100, 150, 200]},
+    'breakout': {'lookback': [20, 55, 126, 252], 'exit': [10, 20, 50]}
+}
+BACKTEST_METRICS = ('total_return_pct', 'cagr_pct', 'volatility_pct', 'sharpe',
+                    'max_drawdown_pct', 'trades', 'exposure_pct')
+
+def _ffill_panel(panel: np.ndarray) -> np.ndarray:
+    """Carry each column's last value over the rows it has no bar on"""
+    rows = np.where(~np.isnan(panel), np.arange(panel.shape[0])[:, None], 0)
+    return panel[np.maximum.accumulate(rows, axis=0), np.arange(panel.shape[1])]
+
+class BacktestPanel:
+    """Price panel prepared once for running many strategies and parameter sets
+
+    Signals are taken at a bar's close and earn the following bars' returns.
+    Missing bars are filled with the ticker's last price for the signals and
+    earn nothing. Every change of position pays commission plus slippage, in
+    basis points of the traded value.
+    """
+
+    def __init__(self, closes: np.ndarray, highs: np.ndarray, lows: np.ndarray,
+                 commission_bps: float = 0.0, slippage_bps: float = 0.0):
+        self.filled = {'close': _ffill_panel(closes), 'high': _ffill_panel(highs),
+                       'low': _ffill_panel(lows)}
+        self.returns = np.nan_to_num(panel_returns(closes))
+        self.started = np.cumsum(~np.isnan(closes), axis=0) > 0
+        # Rows with a return: every row after the ticker's first bar
+        self.earning = np.zeros_like(self.started)
+        self.earning[1:] = self.started[:-1]
+        self.bars = np.maximum(self.earning.sum(axis=0), 1)
+        self.cost = (commission_bps + slippage_bps) / 10_000
+        self._windows = {}
+        # Running sums and bar counts turn every moving average into one subtraction
+        self._close_sums = np.zeros((closes.shape[0] + 1, closes.shape[1]))
+        np.cumsum(np.nan_to_num(self.filled['close']), axis=0, out=self._close_sums[1:])
+        self._close_counts = np.concatenate((np.zeros((1, closes.shape[1])),
+                                             np.cumsum(self.started, axis=0)))
+
+    def window(self, kind: str, length: int) -> np.ndarray:
+        """Rolling mean of closes, or the high/low of the previous length bars, computed once"""
+        key = (kind, length)
+        if key not in self._windows:
+            if kind == 'mean':
+                full = (self._close_counts[length:] - self._close_counts[:-length]) == length
+                means = np.full_like(self.returns, np.nan)
+                means[length - 1:] = np.where(
+                    full, (self._close_sums[length:] - self._close_sums[:-length]) / length, np.nan
+                )
+                self._windows[key] = means
+            else:
+                rolling = pd.DataFrame(self.filled[kind]).rolling(length)
+                extreme = rolling.max() if kind == 'high' else rolling.min()
+                self._windows[key] = extreme.shift(1).to_numpy()
+        return self._windows[key]
+
+    def positions(self, strategy: str, params: dict) -> np.ndarray:
+        """Return the long (1) or flat (0) position of each ticker after each bar's close"""
+        if strategy == 'ma_crossover':
+            return self.window('mean', params['fast']) > self.window('mean', params['slow'])
+        if strategy == 'breakout':
+            close = self.filled['close']
+            # Enter on a close above the lookback high, exit on a close below the exit low
+            signal = np.where(close > self.window('high', params['lookback']), 1.0,
+                              np.where(close < self.window('low', params['exit']), 0.0, np.nan))
+            return np.nan_to_num(_ffill_panel(signal))
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {list(BACKTEST_GRIDS)}")
+
+    def simulate(self, strategy: str, params: dict) -> tuple:
+        """Return (position held during each bar, net strategy return of each bar)"""
+        held = np.zeros_like(self.returns)
+        held[1:] = self.positions(strategy, params)[:-1]
+        strategy_returns = held * self.returns
+        # Positions are 0 or 1, so each change trades the whole position
+        strategy_returns[1:] -= (held[1:] != held[:-1]) * self.cost
+        return held, strategy_returns
+
+    def sweep(self, strategy: str, grid: dict) -> tuple:
+        """Run every parameter combination of grid and return (combinations, metrics)
+
+        metrics has shape (combinations, BACKTEST_METRICS, tickers).
+        """
+        names = list(grid)
+        combinations = [dict(zip(names, values))
+                        for values in itertools.product(*(grid[name] for name in names))]
+        if strategy == 'ma_crossover':
+            combinations = [params for params in combinations if params['fast'] < params['slow']]
+        metrics = np.full((len(combinations), len(BACKTEST_METRICS), self.returns.shape[1]),
+                          np.nan)
+        for combo_idx, params in enumerate(combinations):
+            held, strategy_returns = self.simulate(strategy, params)
+            # Returns are zero before a ticker's first bar, so plain sums cover its own bars
+            mean = strategy_returns.sum(axis=0) / self.bars
+            squares = np.einsum('ij,ij->j', strategy_returns, strategy_returns)
+            std = np.sqrt(np.maximum(squares - self.bars * mean ** 2, 0)
+                          / np.maximum(self.bars - 1, 1))
+            equity = np.cumprod(strategy_returns + 1, axis=0)
+            drawdown = (equity / np.maximum.accumulate(equity, axis=0)).min(axis=0) - 1
+            with np.errstate(divide='ignore', invalid='ignore'):
+                metrics[combo_idx] = [
+                    (equity[-1] - 1) * 100,
+                    (equity[-1] ** (252 / self.bars) - 1) * 100,
+                    std * 252 ** 0.5 * 100,
+                    np.where(std > 0, mean / std * 252 ** 0.5, np.nan),
+                    drawdown * 100,
+                    (held[1:] > held[:-1]).sum(axis=0),
+                    held.sum(axis=0) / self.bars * 100
+                ]
+        return combinations, metrics
+
+def export_data(data: pd.DataFrame, ticker: str, name: str, output_dir: str,
+                timestamp: str, as_of=None):
+    """Write data in the configured columnar and warehouse formats, logging failures
+
+    name is 'historical', 'summary' (a Series of metric values) or a data
+    type; as_of dates snapshot rows in the warehouse.
+    """
+    try:
+        if name != 'summary':
+            for path in export_columnar(data, ticker, name, os.path.join(output_dir, ticker),
+                                        timestamp, CONFIG['export_formats']):
+                logger.info("✓ %s", os.path.basename(path))
+        if 'sqlite' in CONFIG['export_formats']:
+            table, rows = warehouse_rows(data, ticker, name,
+                                         as_of or pd.Timestamp.now().normalize())
+            upsert_warehouse(warehouse_path(output_dir), table, rows)
+    except (ValueError, TypeError, OSError, ImportError, sqlite3.Error) as e:
+        logger.warning("Error exporting %s: %s", name, str(e))
+
 def analyze_stock(ticker: str, period: str = CONFIG['default_period'],
-                output_dir: str = CONFIG['output_directory']) -> dict:
-    """Download and save comprehensive stock data with retries"""
+                output_dir: str = CONFIG['output_directory'],
+                hist_data: pd.DataFrame = None,
+                chart_executor: ProcessPoolExecutor = None,
+                metrics: pd.Series = None, universe: dict = None,
+                interval: str = '1d', store_bars: dict = None,
+                chart_jobs: deque = None) -> dict:
+    """Download and save comprehensive stock data
+
+    Each network request is retried on its own, so data already fetched is
+    never downloaded or processed twice.
+
+    hist_data can carry price history already fetched by the batched download
+    stage, in which case the per-ticker history request is skipped.
+    With chart_executor the chart renders in another process while the
+    fundamentals are fetched and exported; with chart_jobs as well, the
+    (ticker, future) pair is appended to it for the caller to wait on
+    instead of being waited for here. metrics can carry the ticker's row of
+    the cross-section already computed by the universe-wide panel pass.
+    With universe, the ticker's screener row (summary metrics and latest
+    indicator values) is stored in it under the ticker. An intraday interval
+    summarizes the bars' daily aggregates and adds session metrics.
+    The bars are written to the price store, or collected in store_bars
+    for the caller to write in one go.
+    """
     try:
         logger.info("\nDownloading %s data...", ticker)
-        stock = yf.Ticker(ticker)
+        provider = get_provider()
         timestamp = datetime.now().strftime("%Y%m%d")
         ticker_dir = os.path.join(output_dir, ticker)
         os.makedirs(ticker_dir, exist_ok=True)
 
-        # Get historical data
-        hist_data = stock.history(period=period)
+        # Get historical data unless the batch stage already fetched it
+        if hist_data is None:
+            hist_data = fetch_history(ticker, period, interval)
         if hist_data.empty:
-            raise ValueError(f"No historical data available for {ticker}")
+            raise InvalidTickerError(f"No historical data available for {ticker}")
 
-        # Remove timezones but keep datetime for plotting
-        hist_data = remove_timezone(hist_data)
+        intraday = interval in INTRADAY_LIMITS
+        stored = {ticker: (hist_data, cache_period_start(period, interval))}
+        if store_bars is None:
+            update_price_store(stored, interval)
+        else:
+            store_bars.update(stored)
+        export_data(hist_data, ticker, f"historical_{interval}" if intraday else 'historical',
+                    output_dir, timestamp)
+        indicators = get_indicators(ticker, hist_data, period, interval)
 
         # Create candlestick chart
+        chart_job = None
         if CONFIG['generate_plots']:
             plot_path = os.path.join(ticker_dir, f"{ticker}_chart_{timestamp}.png")
-            create_price_chart(hist_data, ticker, plot_path)
+            if chart_executor is not None:
+                chart_job = chart_executor.submit(render_chart, hist_data, ticker, plot_path,
+                                                  CONFIG['chart_settings'], indicators)
+            else:
+                with _chart_lock:
+                    create_price_chart(hist_data, ticker, plot_path, indicators=indicators)
 
-        # Process all requested data types
+        # Process all requested data types, converting each for Excel only once
         data_types = {}
+        excel_frames = {}
+        per_type_excel = ('excel' in CONFIG['export_formats']
+                          and CONFIG.get('excel_per_type', True))
+        summary_excel = CONFIG.get('generate_summary')
         for data_type in CONFIG['data_types']:
-            if not hasattr(stock, data_type):
+            if not provider.supports(data_type):
                 continue
             try:
-                # Get the data and handle conversion
-                data = getattr(stock, data_type)
+                # Get the data from the cache or Yahoo and handle conversion
+                data = load_cached_fundamental(ticker, data_type)
+                if data is None:
+                    data = request_data_type(ticker, data_type)
+                    save_cached_fundamental(ticker, data_type, data)
                 if isinstance(data, pd.Series):
                     data = data.to_frame(name=data_type.capitalize())
                 data = handle_data(data, data_type)
@@ -268,84 +2554,1039 @@ def analyze_stock(ticker: str, period: str = CONFIG['default_period'],
                     data = remove_timezone(data)
                     data_types[data_type] = data
 
-                    if 'excel' in CONFIG['export_formats']:
+                    export_data(data, ticker, data_type, output_dir, timestamp)
+                    if per_type_excel or summary_excel:
+                        excel_data = to_excel_frame(data)
+                        if summary_excel:
+                            excel_frames[data_type] = excel_data
+
+                    if per_type_excel:
                         filepath = os.path.join(
                             ticker_dir,
                             f"{ticker}_{data_type}_{timestamp}.xlsx"
                         )
-                        # Convert to date for Excel export
-                        excel_data = data.copy()
-
-                        if isinstance(excel_data.index, pd.DatetimeIndex):
-                            excel_data.index = excel_data.index.date
-
-                        # Handle datetime columns
-                        datetime_cols = excel_data.select_dtypes(include=['datetime64']).columns
-                        for col in datetime_cols:
-                            excel_data[col] = excel_data[col].dt.date
-
-                        excel_data.to_excel(filepath, engine='openpyxl')
+                        with open_excel_workbook(filepath) as write_sheet:
+                            write_sheet(excel_data, 'Sheet1')
                         logger.info("✓ %s", os.path.basename(filepath))
             except (ValueError, TypeError, KeyError) as e:
                 logger.warning("Error processing %s: %s", data_type, str(e))
                 continue
 
-        # Create summary Excel
-        if CONFIG.get('generate_summary'):
+        # Price metrics followed by the latest indicator values, formatted for
+        # Excel and as numbers keyed by metric name for the warehouse
+        summary_data = None
+        summary_values = None
+        try:
+            if metrics is None:
+                metrics = (summarize_universe({ticker: daily_bars(hist_data)})[1].iloc[0]
+                           if intraday else
+                           summarize_universe({ticker: hist_data}, period)[1].iloc[0])
+            session = intraday_metrics(hist_data) if intraday else pd.Series(dtype=float)
+            if universe is not None:
+                universe[ticker] = {**metrics.to_dict(), **session.to_dict(),
+                                    **indicators.iloc[-1].to_dict()}
+            if summary_excel:
+                tables = [format_summary(metrics)]
+                if intraday:
+                    tables.append(format_summary(session, INTRADAY_METRICS))
+                summary_data = pd.concat(tables + [indicator_summary(indicators)],
+                                         ignore_index=True)
+            if 'sqlite' in CONFIG['export_formats']:
+                latest = indicators.iloc[-1] if len(indicators) else pd.Series(dtype=float)
+                summary_values = pd.Series({
+                    **{key: metrics[key] for key in SUMMARY_METRICS},
+                    **{key: session[key] for key in (INTRADAY_METRICS if intraday else ())},
+                    **{key: latest.get(key, np.nan) for key in INDICATOR_METRICS}
+                }, dtype=float)
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            logger.warning("Error computing summary: %s", str(e))
+
+        if summary_values is not None:
+            try:
+                export_data(summary_values, ticker, 'summary', output_dir, timestamp,
+                            as_of=hist_data.index[-1])
+            except (ValueError, TypeError, KeyError, IndexError) as e:
+                logger.warning("Error exporting summary: %s", str(e))
+
+        # Create summary Excel from the frames converted above
+        if summary_excel:
             try:
                 summary_path = os.path.join(ticker_dir, f"{ticker}_summary_{timestamp}.xlsx")
-                with pd.ExcelWriter(summary_path, engine='openpyxl') as writer:
+                with open_excel_workbook(summary_path) as write_sheet:
                     # Write summary
-                    summary_data = analyze_stock_data(hist_data)
-                    summary_data.to_excel(writer, sheet_name='Summary', index=False)
+                    if summary_data is not None:
+                        write_sheet(summary_data, 'Summary', index=False)
 
                     # Write historical data
-                    excel_hist = hist_data.copy()
-                    excel_hist.index = excel_hist.index.date
-                    excel_hist.to_excel(writer, sheet_name='Historical Data')
+                    write_sheet(to_excel_frame(hist_data), 'Historical Data')
 
                     # Write other data
-                    for name, data in data_types.items():
-                        if data is not None:
-                            excel_data = data.copy()
-
-                            # Always ensure we have a DataFrame
-                            if isinstance(excel_data, pd.Series):
-                                excel_data = excel_data.to_frame(name=name.capitalize())
-
-                            if isinstance(excel_data.index, pd.DatetimeIndex):
-                                excel_data.index = excel_data.index.date
-
-                            datetime_cols = excel_data.select_dtypes(include=['datetime64']).columns
-                            for col in datetime_cols:
-                                excel_data[col] = excel_data[col].dt.date
-
-                            sheet_name = str(name)[:31]  # Excel sheet name length limit
-                            excel_data.to_excel(writer, sheet_name=sheet_name)
+                    for name, excel_data in excel_frames.items():
+                        sheet_name = str(name)[:31]  # Excel sheet name length limit
+                        write_sheet(excel_data, sheet_name)
                 logger.info("✓ Created summary Excel file")
             except (ValueError, TypeError, KeyError) as e:
                 logger.error("Error creating summary Excel: %s", str(e))
 
+        if chart_job is not None:
+            if chart_jobs is None:
+                chart_job.result()
+            else:
+                chart_jobs.append((ticker, chart_job))
         logger.info("✓ Data saved to: %s", ticker_dir)
         return data_types
     except Exception as e:
         logger.error("Error analyzing %s: %s", ticker, str(e))
         raise
 
+def export_cross_section(cross_section: pd.DataFrame, output_dir: str):
+    """Write the universe-wide metrics table next to the per-ticker folders"""
+    if not CONFIG.get('generate_summary') or len(cross_section) < 2:
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d")
+    path = os.path.join(output_dir, f"universe_summary_{timestamp}.xlsx")
+    with open_excel_workbook(path) as write_sheet:
+        write_sheet(to_excel_frame(cross_section), 'Universe')
+    logger.info("✓ %s", os.path.basename(path))
+
+def universe_path() -> str:
+    """Return the screener table holding the latest metrics of every analyzed ticker"""
+    return cache_path('universe.parquet')
+
+def load_universe() -> pd.DataFrame:
+    """Load the screener table, indexed by ticker, or an empty frame if there is none"""
+    path = universe_path()
+    if not os.path.exists(path):
+        return pd.DataFrame(index=pd.Index([], name='Ticker'))
+    return pd.read_parquet(path)
+
+def update_universe(rows: dict, period: str, interval: str = '1d'):
+    """Merge freshly analyzed tickers into the screener table, replacing their old rows"""
+    if not CONFIG.get('use_cache', True) or not rows:
+        return
+    fresh = pd.DataFrame.from_dict(rows, orient='index').rename_axis('Ticker')
+    fresh['period'] = period
+    fresh['interval'] = interval
+    fresh['updated'] = pd.Timestamp.now().floor('s')
+    try:
+        universe = load_universe()
+        universe = pd.concat([universe[~universe.index.isin(fresh.index)], fresh])
+        os.makedirs(os.path.dirname(universe_path()), exist_ok=True)
+        universe.sort_index().to_parquet(universe_path() + '.tmp')
+        os.replace(universe_path() + '.tmp', universe_path())
+    except (OSError, ValueError, ImportError) as e:
+        logger.warning("Could not update the screener table: %s", str(e))
+
+# A '%' ending a number literal that is not followed by an operand, which
+# would make it the modulo operator as in 'ma_50 % 5' or '7 % 2 == 1'
+PERCENT_LITERAL = re.compile(
+    r"(?<![\w.])(\d+(?:\.\d*)?|\.\d+)\s*%"
+    r"(?!\s*(?:(?!(?:and|or|not|in|is)\b)[\w(.'\"`]|[-+~]\s*[\w(.]))"
+)
+
+def _screen_expression(expression: str) -> str:
+    """Allow percent literals such as 'volatility_pct < 30%'; percent columns hold percents"""
+    return PERCENT_LITERAL.sub(r'\1', expression)
+
+def screen_universe(universe: pd.DataFrame, screen: str = None, rank: str = None,
+                    top: int = None, ascending: bool = False) -> pd.DataFrame:
+    """Filter and rank the screener table with vectorized expressions over its columns
+
+    screen is a boolean DataFrame.query expression and rank a DataFrame.eval
+    expression whose value, stored as rank_score, orders the rows (highest
+    first unless ascending). top keeps only the first rows.
+    """
+    result = universe
+    if screen:
+        result = result.query(_screen_expression(screen))
+    if rank:
+        result = result.assign(rank_score=result.eval(_screen_expression(rank)))
+        result = result.sort_values('rank_score', ascending=ascending, na_position='last')
+    if top:
+        result = result.head(top)
+    return result
+
+def run_screen(screen: str, rank: str, top: int, ascending: bool, output_dir: str) -> pd.DataFrame:
+    """Screen the cached universe, print the matches and save them next to the ticker folders"""
+    universe = load_universe()
+    if universe.empty:
+        raise ValueError("The screener table is empty, analyze some tickers first")
+    started = time.perf_counter()
+    try:
+        result = screen_universe(universe, screen, rank, top, ascending)
+    except (NameError, SyntaxError, ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"Invalid screen expression: {e}. Available columns: "
+                         f"{', '.join(map(str, universe.columns))}") from e
+    logger.info("%d of %d tickers matched in %.1f ms", len(result), len(universe),
+                (time.perf_counter() - started) * 1000)
+
+    columns = [col for col in ('rank_score', *SUMMARY_METRICS, 'rsi_14', 'last_date')
+               if col in result.columns]
+    print(result[columns].to_string(float_format=lambda value: f"{value:.2f}"))
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"screen_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
+    with open_excel_workbook(path) as write_sheet:
+        write_sheet(to_excel_frame(result), 'Screen')
+    logger.info("✓ %s", os.path.basename(path))
+    return result
+
+def run_correlation(tickers: list, period: str, output_dir: str) -> list:
+    """Write return correlation and covariance matrices for cached tickers
+
+    Uses every ticker in the price store or the history cache when tickers
+    is empty. The matrices are memory-mapped .npy files under
+    <output>/Correlation, with the ticker order in a JSON file; small
+    universes also get an Excel workbook. Returns the tickers included.
+    """
+    histories = load_period_histories(tickers, period)
+    missing = [ticker for ticker in tickers if ticker not in histories]
+    if missing:
+        logger.warning("No cached %s history for %d ticker(s), analyze them first: %s",
+                       period, len(missing), ', '.join(missing[:20]))
+    if len(histories) < 2:
+        raise ValueError("The correlation mode needs cached history for at least two tickers")
+
+    dates, tickers, closes = build_price_panel(histories, fields=('Close',))
+    returns = panel_returns(closes)
+    del closes
+    num_tickers = len(tickers)
+    correlation_dir = os.path.join(output_dir, 'Correlation')
+    os.makedirs(correlation_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d")
+    started = time.perf_counter()
+    matrices = {
+        name: np.lib.format.open_memmap(
+            os.path.join(correlation_dir, f"{name}_{period}_{timestamp}.npy"), mode='w+',
+            dtype=dtype, shape=(num_tickers, num_tickers))
+        for name, dtype in (('correlation', np.float64), ('covariance', np.float64),
+                            ('observations', np.int32))
+    }
+    blockwise_correlation(returns, matrices['correlation'], matrices['covariance'],
+                          matrices['observations'],
+                          block_size=CONFIG.get('correlation_block_size', 500),
+                          min_periods=CONFIG.get('correlation_min_periods', 20))
+    for matrix in matrices.values():
+        matrix.flush()
+    with open(os.path.join(correlation_dir, f"tickers_{period}_{timestamp}.json"), 'w',
+              encoding="utf-8") as tickers_file:
+        json.dump({'tickers': tickers, 'period': period, 'start': dates[0].isoformat(),
+                   'end': dates[-1].isoformat()}, tickers_file)
+    logger.info("✓ %dx%d correlation and covariance matrices in %.2fs", num_tickers,
+                num_tickers, time.perf_counter() - started)
+
+    if num_tickers <= CONFIG.get('correlation_excel_max', 250):
+        path = os.path.join(correlation_dir, f"correlation_{period}_{timestamp}.xlsx")
+        with open_excel_workbook(path) as write_sheet:
+            for name, matrix in matrices.items():
+                write_sheet(pd.DataFrame(np.asarray(matrix), index=pd.Index(tickers, name='Ticker'),
+                                         columns=tickers), name.capitalize())
+        logger.info("✓ %s", os.path.basename(path))
+    return tickers
+
+def run_backtest(tickers: list, period: str, output_dir: str, strategy: str,
+                 grid: dict = None, commission_bps: float = None,
+                 slippage_bps: float = None) -> pd.DataFrame:
+    """Backtest a strategy over cached history for a parameter grid and export the results
+
+    Uses every ticker in the price store or the history cache when tickers
+    is empty. Each ticker
+    gets <TICKER>_backtest_<strategy>_<date>.xlsx with one row per parameter
+    combination and the equity curve of its best one by Sharpe ratio; the
+    best combination per ticker is also collected under <output>/Backtest.
+    Returns that per-ticker table.
+    """
+    unknown = set(grid or {}) - set(BACKTEST_GRIDS[strategy])
+    if unknown:
+        raise ValueError(f"Unknown {strategy} parameter(s) {sorted(unknown)}, expected "
+                         f"{list(BACKTEST_GRIDS[strategy])}")
+    grid = {**BACKTEST_GRIDS[strategy], **(grid or {})}
+    commission_bps = CONFIG.get('backtest_commission_bps', 1.0) if commission_bps is None \
+        else commission_bps
+    slippage_bps = CONFIG.get('backtest_slippage_bps', 5.0) if slippage_bps is None \
+        else slippage_bps
+    histories = load_period_histories(tickers, period)
+    missing = [ticker for ticker in tickers if ticker not in histories]
+    if missing:
+        logger.warning("No cached %s history for %d ticker(s), analyze them first: %s",
+                       period, len(missing), ', '.join(missing[:20]))
+    if not histories:
+        raise ValueError("The backtest needs cached history, analyze some tickers first")
+
+    started = time.perf_counter()
+    dates, tickers, closes, highs, lows = build_price_panel(histories)
+    panel = BacktestPanel(closes, highs, lows, commission_bps, slippage_bps)
+    combinations, metrics = panel.sweep(strategy, grid)
+    if not combinations:
+        raise ValueError(f"The parameter grid has no valid combination for {strategy}")
+    logger.info("✓ %d parameter combinations x %d tickers in %.2fs", len(combinations),
+                len(tickers), time.perf_counter() - started)
+
+    params = pd.DataFrame(combinations)
+    sharpe = np.where(np.isnan(metrics[:, BACKTEST_METRICS.index('sharpe')]), -np.inf,
+                      metrics[:, BACKTEST_METRICS.index('sharpe')])
+    best_combo = sharpe.argmax(axis=0)
+    buy_and_hold = (panel.filled['close'][-1] / closes[np.argmax(panel.started, axis=0),
+                                                        np.arange(len(tickers))] - 1) * 100
+    best = pd.concat([params.iloc[best_combo].reset_index(drop=True),
+                      pd.DataFrame(metrics[best_combo, :, np.arange(len(tickers))],
+                                   columns=BACKTEST_METRICS)], axis=1)
+    best.insert(len(params.columns), 'buy_and_hold_pct', buy_and_hold)
+    best.index = pd.Index(tickers, name='Ticker')
+
+    timestamp = datetime.now().strftime("%Y%m%d")
+    equity_curves = {}
+    for col_idx, ticker in enumerate(tickers):
+        combo_idx = best_combo[col_idx]
+        if combo_idx not in equity_curves:
+            equity_curves[combo_idx] = np.cumprod(
+                1 + panel.simulate(strategy, combinations[combo_idx])[1], axis=0)
+        rows = panel.started[:, col_idx]
+        equity = pd.DataFrame({
+            'Strategy': equity_curves[combo_idx][rows, col_idx],
+            'Buy & Hold': panel.filled['close'][rows, col_idx]
+                          / panel.filled['close'][rows, col_idx][0]
+        }, index=pd.DatetimeIndex(dates[rows], name='Date'))
+        results = pd.concat([params, pd.DataFrame(metrics[:, :, col_idx],
+                                                  columns=BACKTEST_METRICS)], axis=1)
+        results = results.sort_values('sharpe', ascending=False, na_position='last')
+
+        ticker_dir = os.path.join(output_dir, ticker)
+        os.makedirs(ticker_dir, exist_ok=True)
+        path = os.path.join(ticker_dir, f"{ticker}_backtest_{strategy}_{timestamp}.xlsx")
+        try:
+            with open_excel_workbook(path) as write_sheet:
+                write_sheet(results, 'Results', index=False)
+                write_sheet(to_excel_frame(equity), 'Best Equity')
+        except (ValueError, OSError) as e:
+            logger.warning("Error exporting backtest for %s: %s", ticker, str(e))
+
+    backtest_dir = os.path.join(output_dir, 'Backtest')
+    os.makedirs(backtest_dir, exist_ok=True)
+    path = os.path.join(backtest_dir, f"backtest_{strategy}_{period}_{timestamp}.xlsx")
+    with open_excel_workbook(path) as write_sheet:
+        write_sheet(best, 'Best Parameters')
+        write_sheet(pd.DataFrame([{
+            'strategy': strategy, 'period': period, 'start': dates[0].date(),
+            'end': dates[-1].date(), 'commission_bps': commission_bps,
+            'slippage_bps': slippage_bps, 'combinations': len(combinations),
+            'grid': json.dumps(grid)
+        }]), 'Settings', index=False)
+    logger.info("✓ %s", os.path.basename(path))
+    return best
+
+def load_portfolio(path: str) -> tuple:
+    """Read a portfolio file and return (kind, amounts by ticker)
+
+    kind is 'weight' or 'shares'. A JSON file maps tickers to weights; a CSV
+    file has a ticker (or symbol) column and a weight or shares column.
+    """
+    if path.lower().endswith('.json'):
+        with open(path, 'r', encoding="utf-8") as portfolio_file:
+            amounts = pd.Series(json.load(portfolio_file), dtype=float)
+        kind = 'weight'
+    else:
+        holdings = pd.read_csv(path)
+        holdings.columns = [str(col).strip().lower() for col in holdings.columns]
+        ticker_col = next((col for col in ('ticker', 'symbol') if col in holdings.columns), None)
+        kind = next((col for col in ('weight', 'shares') if col in holdings.columns), None)
+        if ticker_col is None or kind is None:
+            raise ValueError(f"{path} needs a ticker column and a weight or shares column")
+        amounts = pd.Series(holdings[kind].to_numpy(dtype=float),
+                            index=holdings[ticker_col].astype(str).str.strip().str.upper())
+        amounts = amounts.groupby(level=0, sort=False).sum()
+    amounts.index = amounts.index.astype(str).str.upper()
+    if amounts.empty or amounts.isna().any():
+        raise ValueError(f"{path} has no holdings or a holding without a {kind}")
+    return kind, amounts
+
+def portfolio_analytics(returns: np.ndarray, weights: np.ndarray,
+                        risk_free_rate: float = 0.0) -> tuple:
+    """Compute portfolio metrics and per-holding risk figures from a returns matrix
+
+    returns is dates x holdings with no missing values and weights sum to 1;
+    the portfolio is rebalanced to the weights every bar. Returns
+    (summary dict, holdings dict of arrays, portfolio returns).
+    """
+    periods_per_year = 252
+    portfolio_returns = returns @ weights
+    covariance = np.cov(returns, rowvar=False, ddof=1).reshape(len(weights), len(weights))
+    covariance *= periods_per_year
+    variance = weights @ covariance @ weights
+    volatility = np.sqrt(variance)
+    marginal = covariance @ weights / volatility if volatility > 0 else np.full_like(weights, np.nan)
+    equity = np.cumprod(1 + portfolio_returns)
+    excess = portfolio_returns.mean() * periods_per_year - risk_free_rate
+    summary = {
+        'Total Return': (equity[-1] - 1) * 100,
+        'Annualized Return': (equity[-1] ** (periods_per_year / len(equity)) - 1) * 100,
+        'Volatility (Annualized)': volatility * 100,
+        'Sharpe Ratio': excess / volatility if volatility > 0 else np.nan,
+        'Max Drawdown': (equity / np.maximum.accumulate(equity) - 1).min() * 100
+    }
+    holdings = {
+        'weight_pct': weights * 100,
+        'return_ann_pct': returns.mean(axis=0) * periods_per_year * 100,
+        'volatility_pct': np.sqrt(np.diag(covariance)) * 100,
+        'return_contribution_pct': weights * returns.mean(axis=0) * periods_per_year * 100,
+        'marginal_risk_pct': marginal * 100,
+        'risk_contribution_pct': weights * marginal * 100,
+        'risk_share_pct': weights * marginal / volatility * 100 if volatility > 0
+                          else np.full_like(weights, np.nan)
+    }
+    return summary, holdings, portfolio_returns
+
+def fetch_histories(tickers: list, period: str, batch_size: int) -> dict:
+    """Fetch history for tickers once, batched when batch_size > 0, skipping failures
+
+    Tickers the batched download did not return are fetched one at a time.
+    """
+    histories = {}
+    if batch_size > 0 and len(tickers) > 1:
+        histories = load_histories(tickers, period, batch_size)
+    for ticker in [ticker for ticker in tickers if ticker not in histories]:
+        try:
+            hist_data = fetch_history(ticker, period)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning("Could not fetch %s history: %s", ticker, str(e) or type(e).__name__)
+            continue
+        if not hist_data.empty:
+            histories[ticker] = hist_data
+    return histories
+
+def run_portfolio(portfolio: tuple, period: str, output_dir: str, histories: dict = None,
+                  batch_size: int = 0, name: str = 'portfolio') -> dict:
+    """Analyze a portfolio from load_portfolio and export it under <output>/Portfolio
+
+    histories can carry history already fetched for other tickers of the run;
+    only the holdings missing from it are fetched. Returns the summary metrics.
+    """
+    kind, amounts = portfolio
+    histories = dict(histories or {})
+    missing = [ticker for ticker in amounts.index if ticker not in histories]
+    if missing:
+        histories.update(fetch_histories(missing, period, batch_size))
+    unavailable = [ticker for ticker in amounts.index if ticker not in histories]
+    if unavailable:
+        raise ValueError(f"No price history for holding(s): {', '.join(unavailable)}")
+
+    dates, tickers, closes = build_price_panel({ticker: histories[ticker]
+                                                for ticker in amounts.index}, fields=('Close',))
+    # Analyze the dates every holding has traded since its first bar
+    first_rows = np.argmax(~np.isnan(closes), axis=0)
+    start = first_rows.max()
+    returns = np.nan_to_num(panel_returns(closes)[start + 1:])
+    if len(returns) < 2:
+        raise ValueError("The holdings share too little history for portfolio analytics")
+    last_prices = _ffill_panel(closes)[-1]
+    values = amounts.to_numpy() * (last_prices if kind == 'shares' else 1.0)
+    if values.sum() == 0:
+        raise ValueError("Portfolio weights sum to zero")
+    weights = values / values.sum()
+
+    summary, holdings, portfolio_returns = portfolio_analytics(
+        returns, weights, CONFIG.get('risk_free_rate', 0.0))
+    summary = {'Start': dates[start].date(), 'End': dates[-1].date(), 'Holdings': len(tickers),
+               **summary}
+    holdings = pd.DataFrame(holdings, index=pd.Index(tickers, name='Ticker'))
+    if kind == 'shares':
+        holdings.insert(0, 'shares', amounts.to_numpy())
+        holdings.insert(1, 'market_value', values)
+    equity = np.cumprod(1 + portfolio_returns)
+    curve = pd.DataFrame({'Equity': equity,
+                          'Drawdown %': (equity / np.maximum.accumulate(equity) - 1) * 100},
+                         index=pd.DatetimeIndex(dates[start + 1:], name='Date'))
+    correlation = pd.DataFrame(np.corrcoef(returns, rowvar=False).reshape(len(tickers), -1),
+                               index=tickers, columns=tickers)
+
+    portfolio_dir = os.path.join(output_dir, 'Portfolio')
+    os.makedirs(portfolio_dir, exist_ok=True)
+    path = os.path.join(portfolio_dir,
+                        f"{name}_{period}_{datetime.now().strftime('%Y%m%d')}.xlsx")
+    with open_excel_workbook(path) as write_sheet:
+        write_sheet(pd.DataFrame(summary.items(), columns=['Metric', 'Value']), 'Summary',
+                    index=False)
+        write_sheet(holdings, 'Holdings')
+        write_sheet(to_excel_frame(curve), 'Equity')
+        write_sheet(correlation, 'Correlation')
+    for metric, value in summary.items():
+        logger.info("%-24s %s", metric, f"{value:.2f}" if isinstance(value, float) else value)
+    logger.info("✓ %s", os.path.basename(path))
+    return summary
+
+def run_tickers(tickers: list, period: str, output_dir: str, workers: int = 1,
+                batch_size: int = 0, chart_workers: int = 0, histories: dict = None,
+                interval: str = '1d') -> dict:
+    """Analyze each ticker, concurrently when workers > 1, and collect per-ticker results
+
+    When batch_size > 0 and several tickers are requested, price history is
+    fetched up front in multi-symbol chunks of that size. chart_workers > 0
+    renders charts in a separate process pool of that size. histories can
+    carry history already fetched for some tickers, which is not fetched again.
+    interval selects daily or intraday bars.
+    Tickers that recently returned no data are skipped without a request.
+    Returns a dict mapping ticker to None on success or to the error message on failure.
+    """
+    requested = list(tickers)
+    results = {}
+    invalid = []
+    if CONFIG.get('use_cache', True) and not CONFIG.get('refresh'):
+        known_invalid = load_negative_cache()
+        for ticker in tickers:
+            if ticker in known_invalid:
+                results[ticker] = (f"Skipped, no data on a previous run "
+                                   f"(cached until {known_invalid[ticker][:10]})")
+                logger.info("Skipping known invalid ticker %s", ticker)
+        tickers = [ticker for ticker in tickers if ticker not in results]
+
+    use_chart_pool = chart_workers > 0 and CONFIG['generate_plots'] and tickers
+    chart_jobs = deque()
+    chart_errors = {}
+    universe = {}
+    store_bars = {}
+    store_lock = threading.Lock()
+
+    def _flush_store(minimum: int = 1):
+        # Write the collected bars in groups so the store index is rewritten rarely
+        with store_lock:
+            if len(store_bars) < minimum:
+                return
+            pending = dict(store_bars)
+            store_bars.clear()
+        update_price_store(pending, interval)
+
+    # Persist whatever was learned even when the run is cut short
+    try:
+        with (start_chart_pool(chart_workers) if use_chart_pool
+              else contextlib.nullcontext()) as chart_pool:
+            histories = {ticker: histories[ticker] for ticker in tickers
+                         if histories and ticker in histories}
+            missing = [ticker for ticker in tickers if ticker not in histories]
+            if batch_size > 0 and len(missing) > 1:
+                histories.update(load_histories(missing, period, batch_size, interval))
+
+            # Compute every prefetched ticker's summary in one pass over the price panel
+            cross_section = pd.DataFrame()
+            if histories:
+                try:
+                    if interval in INTRADAY_LIMITS:
+                        cross_section = summarize_universe(
+                            {ticker: daily_bars(hist_data)
+                             for ticker, hist_data in histories.items()})[1]
+                    else:
+                        cross_section = summarize_universe(histories, period)[1]
+                    export_cross_section(cross_section, output_dir)
+                except (ValueError, TypeError, KeyError, IndexError, OSError) as e:
+                    logger.warning("Error computing universe summary: %s", str(e))
+
+            def _analyze(ticker):
+                _log_context.ticker = ticker if workers > 1 else None
+                try:
+                    # Hand the bars over so they are freed once the ticker is done
+                    analyze_stock(ticker, period, output_dir, hist_data=histories.pop(ticker, None),
+                                  chart_executor=chart_pool,
+                                  metrics=(cross_section.loc[ticker]
+                                           if ticker in cross_section.index else None),
+                                  universe=universe, interval=interval, store_bars=store_bars,
+                                  chart_jobs=chart_jobs)
+                    _flush_store(CONFIG.get('price_store_batch', 100))
+                except InvalidTickerError:
+                    invalid.append(ticker)
+                    raise
+                finally:
+                    _log_context.ticker = None
+
+            def _error_message(error):
+                return str(error) or type(error).__name__
+
+            def _collect_charts(limit: int = 0):
+                # Charts render while the next tickers are processed; wait for the
+                # oldest once more than limit are pending so queued bars stay bounded
+                while len(chart_jobs) > limit:
+                    ticker, job = chart_jobs.popleft()
+                    try:
+                        job.result()
+                    except Exception as e:  # pylint: disable=broad-except
+                        chart_errors[ticker] = f"Chart failed: {_error_message(e)}"
+                        print(f"✗ Error rendering {ticker} chart: {_error_message(e)}")
+
+            if workers <= 1:
+                for ticker_idx, ticker in enumerate(tickers, 1):
+                    print(f"\n[{ticker_idx}/{len(tickers)}] Analyzing {ticker}...")
+                    try:
+                        with ticker_timeout(CONFIG.get('ticker_timeout', 300), ticker):
+                            _analyze(ticker)
+                        results[ticker] = None
+                    except Exception as e:  # pylint: disable=broad-except
+                        results[ticker] = _error_message(e)
+                        print(f"✗ Error processing {ticker}: {results[ticker]}")
+                    _collect_charts(2 * chart_workers)
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = {executor.submit(_analyze, ticker): ticker for ticker in tickers}
+                    for done_idx, future in enumerate(as_completed(futures), 1):
+                        ticker = futures[future]
+                        try:
+                            future.result()
+                            results[ticker] = None
+                            print(f"[{done_idx}/{len(tickers)}] ✓ {ticker}")
+                        except Exception as e:  # pylint: disable=broad-except
+                            results[ticker] = _error_message(e)
+                            print(f"[{done_idx}/{len(tickers)}] ✗ {ticker}: {results[ticker]}")
+                        _collect_charts(2 * chart_workers)
+            _collect_charts()
+            results.update(chart_errors)
+    finally:
+        # An outage also yields empty histories, so only trust the verdict when
+        # another ticker in the same run did receive data
+        if any(error is None for error in results.values()):
+            mark_invalid_tickers(invalid)
+        update_universe(universe, period, interval)
+        _flush_store()
+    return {ticker: results[ticker] for ticker in requested}
+
+def print_run_summary(results: dict):
+    """Print per-ticker success or failure for a batch run"""
+    failed = {ticker: error for ticker, error in results.items() if error is not None}
+    print(f"\nSucceeded: {len(results) - len(failed)}/{len(results)}")
+    for ticker, error in results.items():
+        if error is None:
+            print(f"  ✓ {ticker}")
+        else:
+            print(f"  ✗ {ticker}: {error}")
+
+def synthetic_history(rows: int, freq: str = 'B', seed: int = 0) -> pd.DataFrame:
+    """Build a random-walk OHLCV frame shaped like yf.Ticker.history output"""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, rows)))
+    open_ = close * (1 + rng.normal(0, 0.003, rows))
+    return pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) * (1 + rng.uniform(0, 0.01, rows)),
+        'Low': np.minimum(open_, close) * (1 - rng.uniform(0, 0.01, rows)),
+        'Close': close,
+        'Volume': rng.integers(100_000, 10_000_000, rows),
+        'Dividends': 0.0,
+        'Stock Splits': 0.0
+    }, index=pd.date_range(end=pd.Timestamp.now().normalize(), periods=rows, freq=freq,
+                           name='Date'))
+
+def synthetic_fundamentals(seed: int = 0) -> dict:
+    """Build frames shaped like the statement, dividend and info data types"""
+    rng = np.random.default_rng(seed)
+    annual = pd.DatetimeIndex(pd.date_range(end='2024-09-30', periods=4, freq='YE-SEP')[::-1])
+    quarterly = pd.DatetimeIndex(pd.date_range(end='2024-09-30', periods=5, freq='QE')[::-1])
+    items = [f"Line Item {item_idx}" for item_idx in range(60)]
+    info = {f"field_{field_idx}": (rng.normal() if field_idx % 3 else f"text {field_idx}")
+            for field_idx in range(150)}
+    return {
+        'financials': pd.DataFrame(rng.normal(1e9, 1e8, (60, 4)), index=items, columns=annual),
+        'quarterly_financials': pd.DataFrame(rng.normal(1e8, 1e7, (60, 5)),
+                                             index=items, columns=quarterly),
+        'balance_sheet': pd.DataFrame(rng.normal(1e9, 1e8, (60, 4)), index=items, columns=annual),
+        'dividends': pd.DataFrame({'Dividends': rng.uniform(0.1, 1, 80)},
+                                  index=pd.date_range(end='2024-12-31', periods=80, freq='QE')),
+        'info': pd.DataFrame([info])
+    }
+
+def benchmark_excel_engines(history_rows: int = 10000, repeats: int = 3) -> pd.DataFrame:
+    """Time each Excel engine writing a summary workbook shaped like the analyzer's
+
+    Reports the best wall time over repeats and the peak Python memory traced
+    while writing.
+    """
+    hist_data = synthetic_history(history_rows)
+    summary_data = analyze_stock_data(hist_data)
+    sheets = [(summary_data, 'Summary', False), (to_excel_frame(hist_data), 'Historical Data', True)]
+    sheets += [(to_excel_frame(frame), name, True)
+               for name, frame in synthetic_fundamentals().items()]
+
+    results = []
+    with tempfile.TemporaryDirectory() as bench_dir:
+        for engine in EXCEL_ENGINES:
+            if engine != 'openpyxl' and xlsxwriter is None:
+                logger.warning("Skipping %s engine, xlsxwriter is not installed", engine)
+                continue
+            path = os.path.join(bench_dir, f"summary_{engine}.xlsx")
+            timings = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                with open_excel_workbook(path, engine) as write_sheet:
+                    for frame, sheet_name, index in sheets:
+                        write_sheet(frame, sheet_name, index=index)
+                timings.append(time.perf_counter() - started)
+
+            tracemalloc.start()
+            with open_excel_workbook(path, engine) as write_sheet:
+                for frame, sheet_name, index in sheets:
+                    write_sheet(frame, sheet_name, index=index)
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append({
+                'Engine': engine,
+                'History Rows': history_rows,
+                'Best Time (s)': round(min(timings), 3),
+                'Peak Memory (MB)': round(peak_bytes / 2 ** 20, 1),
+                'File Size (KB)': round(os.path.getsize(path) / 1024, 1)
+            })
+    return pd.DataFrame(results)
+
+def _reference_remove_timezone(df):
+    """Previous remove_timezone (deep copy, per-column to_datetime), the benchmark baseline"""
+    df = df.copy()
+    if isinstance(df.index, pd.DatetimeIndex) and df.index.tz is not None:
+        df.index = df.index.tz_localize(None)
+    datetime_cols = df.select_dtypes(
+        include=['datetime64[ns]', 'datetime64[ns, UTC]', 'datetime64[ns, US/Eastern]']
+    ).columns
+    for col in datetime_cols:
+        df[col] = pd.to_datetime(df[col]).dt.tz_localize(None)
+    for col in [col for col, dtype in df.dtypes.items() if dtype == object]:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col]).dt.date
+    return df
+
+def benchmark_timezone(intraday_rows: int = 1_000_000, repeats: int = 5) -> pd.DataFrame:
+    """Time timezone normalization on long intraday and wide fundamentals frames
+
+    Compares the previous implementation with the shallow-copy and in-place
+    modes, reporting the best time and peak traced memory per call.
+    """
+    intraday = synthetic_history(intraday_rows, freq='min')
+    intraday.index = intraday.index.tz_localize('UTC').tz_convert('America/New_York')
+    intraday['Exchange Time'] = intraday.index.tz_convert('UTC')
+
+    rng = np.random.default_rng(0)
+    wide = pd.DataFrame(rng.normal(size=(500, 400)),
+                        columns=[f"Item {col_idx}" for col_idx in range(400)])
+    for col_idx in range(0, 400, 40):
+        wide[f"Item {col_idx}"] = pd.date_range('2020-01-01', periods=500, freq='D', tz='UTC')
+    wide.index = pd.date_range('2020-01-01', periods=500, freq='D', tz='Europe/London')
+
+    variants = {
+        'previous': _reference_remove_timezone,
+        'shallow copy': remove_timezone,
+        'in place': lambda frame: remove_timezone(frame, inplace=True)
+    }
+    results = []
+    for shape_name, frame in (('intraday', intraday), ('wide fundamentals', wide)):
+        for variant, normalize in variants.items():
+            timings = []
+            for _ in range(repeats):
+                # In-place runs consume their input, so every run gets a fresh shallow copy
+                sample = frame.copy(deep=False)
+                started = time.perf_counter()
+                normalize(sample)
+                timings.append(time.perf_counter() - started)
+            sample = frame.copy(deep=False)
+            tracemalloc.start()
+            normalize(sample)
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append({
+                'Frame': shape_name,
+                'Shape': f"{frame.shape[0]}x{frame.shape[1]}",
+                'Variant': variant,
+                'Best Time (ms)': round(min(timings) * 1000, 2),
+                'Peak Memory (MB)': round(peak_bytes / 2 ** 20, 1)
+            })
+    return pd.DataFrame(results)
+
+def benchmark_indicators(rows: int = 1_000_000, repeats: int = 3) -> pd.DataFrame:
+    """Time each technical indicator and the full set on a long synthetic history
+
+    Reports the best time over repeats and the throughput in bars per second.
+    """
+    hist_data = synthetic_history(rows, freq='min')
+    arrays = indicator_arrays(hist_data)
+    jobs = {name: lambda indicator=indicator: indicator(**arrays)
+            for name, indicator in INDICATORS.items()}
+    jobs['all (compute_indicators)'] = lambda: compute_indicators(hist_data)
+
+    results = []
+    for name, job in jobs.items():
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            job()
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        results.append({
+            'Indicator': name,
+            'Bars': rows,
+            'Best Time (ms)': round(best * 1000, 1),
+            'Million Bars/s': round(rows / best / 1e6, 1)
+        })
+    return pd.DataFrame(results)
+
+def benchmark_screener(tickers: int = 10_000, repeats: int = 5) -> pd.DataFrame:
+    """Time loading a synthetic screener table and screening and ranking it"""
+    rng = np.random.default_rng(0)
+    price = rng.uniform(5, 500, tickers)
+    universe = pd.DataFrame({
+        'price': price,
+        'high_52w': price * rng.uniform(1, 1.6, tickers),
+        'low_52w': price * rng.uniform(0.5, 1, tickers),
+        'ma_50': price * rng.normal(1, 0.05, tickers),
+        'ma_200': price * rng.normal(1, 0.1, tickers),
+        'volatility_pct': rng.uniform(10, 80, tickers),
+        'return_1m_pct': rng.normal(0, 8, tickers),
+        'return_ytd_pct': rng.normal(5, 25, tickers),
+        'rsi_14': rng.uniform(0, 100, tickers),
+        'period': '2y'
+    }, index=pd.Index([f"T{ticker_idx:05d}" for ticker_idx in range(tickers)], name='Ticker'))
+    universe['dist_52w_high_pct'] = (universe['price'] / universe['high_52w'] - 1) * 100
+    universe['dist_52w_low_pct'] = (universe['price'] / universe['low_52w'] - 1) * 100
+
+    screen = 'dist_52w_high_pct > -5% and volatility_pct < 30%'
+    rank = 'return_1m_pct / volatility_pct'
+    results = []
+    with tempfile.TemporaryDirectory() as bench_dir:
+        path = os.path.join(bench_dir, 'universe.parquet')
+        universe.to_parquet(path)
+        jobs = {
+            'load table': lambda: pd.read_parquet(path),
+            'screen': lambda: screen_universe(universe, screen),
+            'rank top 50': lambda: screen_universe(universe, rank=rank, top=50),
+            'screen + rank top 50': lambda: screen_universe(universe, screen, rank, 50)
+        }
+        for name, job in jobs.items():
+            timings = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                matched = job()
+                timings.append(time.perf_counter() - started)
+            results.append({
+                'Step': name,
+                'Tickers': tickers,
+                'Rows Out': len(matched),
+                'Best Time (ms)': round(min(timings) * 1000, 2)
+            })
+    return pd.DataFrame(results)
+
+def benchmark_backtest(tickers: int = 500, bars: int = 504, repeats: int = 1) -> pd.DataFrame:
+    """Time parameter sweeps of each strategy over a synthetic price panel"""
+    rng = np.random.default_rng(0)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, (bars, tickers)), axis=0))
+    highs = closes * (1 + rng.uniform(0, 0.01, closes.shape))
+    lows = closes * (1 - rng.uniform(0, 0.01, closes.shape))
+    grids = {
+        'ma_crossover': {'fast': list(range(5, 105, 5)), 'slow': list(range(110, 310, 20))},
+        'breakout': {'lookback': list(range(20, 270, 25)), 'exit': list(range(5, 55, 5))}
+    }
+    results = []
+    for strategy, grid in grids.items():
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            combinations, _ = BacktestPanel(closes, highs, lows, 1.0, 5.0).sweep(strategy, grid)
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        results.append({
+            'Strategy': strategy,
+            'Tickers': tickers,
+            'Bars': bars,
+            'Combinations': len(combinations),
+            'Best Time (s)': round(best, 2),
+            'Combinations/s': round(len(combinations) / best, 1)
+        })
+    return pd.DataFrame(results)
+
+def benchmark_price_store(tickers: int = 2000, bars: int = 2520, repeats: int = 3) -> pd.DataFrame:
+    """Time opening the histories of a synthetic universe from Parquet files and the price store"""
+    histories = {f"T{ticker_idx:05d}": synthetic_history(bars, seed=ticker_idx)
+                 for ticker_idx in range(tickers)}
+    start = histories['T00000'].index[-252]
+    results = []
+    with tempfile.TemporaryDirectory() as bench_dir:
+        for ticker, hist_data in histories.items():
+            hist_data.to_parquet(os.path.join(bench_dir, f"{ticker}.parquet"))
+        store = PriceStore(os.path.join(bench_dir, 'store'))
+        store.write({ticker: (hist_data, None) for ticker, hist_data in histories.items()})
+        del histories
+
+        def read_parquet():
+            return {ticker: pd.read_parquet(os.path.join(bench_dir, f"{ticker}.parquet"))
+                    for ticker in store.tickers}
+
+        def open_store():
+            opened = PriceStore(store.directory)
+            return {ticker: opened.bars(ticker, start) for ticker in opened.tickers}
+
+        jobs = {
+            'parquet: load all': read_parquet,
+            'store: open + slice last year': open_store,
+            'parquet: close panel, last year': lambda: build_price_panel(
+                {ticker: hist_data[hist_data.index >= start]
+                 for ticker, hist_data in read_parquet().items()}, fields=('Close',)),
+            'store: close panel, last year': lambda: build_price_panel(open_store(),
+                                                                       fields=('Close',))
+        }
+        for name, job in jobs.items():
+            timings = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                job()
+                timings.append(time.perf_counter() - started)
+            results.append({
+                'Step': name,
+                'Tickers': tickers,
+                'Bars': bars,
+                'Best Time (s)': round(min(timings), 3)
+            })
+    return pd.DataFrame(results)
+
+# Benchmarks available through --benchmark
+BENCHMARKS = {
+    'excel': benchmark_excel_engines,
+    'timezone': benchmark_timezone,
+    'indicators': benchmark_indicators,
+    'screener': benchmark_screener,
+    'backtest': benchmark_backtest,
+    'store': benchmark_price_store
+}
+
+def parse_grid(items) -> dict:
+    """Parse NAME=V1,V2,... parameter grid overrides into lists of integers"""
+    grid = {}
+    for item in items or []:
+        name, _, values = item.partition('=')
+        try:
+            grid[name.strip()] = [int(value) for value in values.split(',') if value.strip()]
+        except ValueError as e:
+            raise ValueError(f"Invalid grid '{item}', expected NAME=V1,V2,...") from e
+        if not grid[name.strip()]:
+            raise ValueError(f"Invalid grid '{item}', expected NAME=V1,V2,...")
+    return grid
+
 def parse_args():
     """Parse command-line arguments"""
     parser = argparse.ArgumentParser(description='Download and analyze stock data')
     parser.add_argument('tickers', nargs='*', help='Ticker symbols to analyze')
     parser.add_argument('--period', '-p', default=CONFIG['default_period'],
                        help='Time period (1d,5d,1mo,3mo,6mo,1y,2y,5y,10y,ytd,max)')
+    parser.add_argument('--interval', '-i', choices=INTERVALS,
+                       default=CONFIG.get('default_interval', '1d'),
+                       help='Bar interval; intraday bars are limited to the history Yahoo '
+                            'serves (30 days of 1m, 60 days of 5m/15m, 730 days of 1h)')
     parser.add_argument('--output', '-o', default=CONFIG['output_directory'],
                        help='Output directory')
     parser.add_argument('--no-plots', action='store_false', dest='generate_plots',
                        help='Disable plot generation')
+    parser.add_argument('--formats', nargs='+', choices=EXPORT_FORMATS,
+                       default=CONFIG['export_formats'],
+                       help='Export formats for historical data and each data type')
+    parser.add_argument('--excel-engine', choices=EXCEL_ENGINES,
+                       default=CONFIG.get('excel_engine', 'openpyxl'),
+                       help='Excel writer; streaming writes rows in constant memory')
+    parser.add_argument('--benchmark', choices=list(BENCHMARKS),
+                       help='Run a benchmark on synthetic data and exit')
+    parser.add_argument('--excel-output', choices=['both', 'per-type', 'summary'],
+                       help='Excel workbooks to write: per-type files, the summary, or both')
+    parser.add_argument('--workers', '-w', type=int, default=CONFIG.get('workers', 1),
+                       help='Number of tickers to analyze concurrently')
+    parser.add_argument('--ticker-timeout', type=float,
+                       default=CONFIG.get('ticker_timeout', 300),
+                       help='Seconds allowed per ticker when --workers is 1 (0 disables)')
+    parser.add_argument('--chart-workers', type=int, default=CONFIG.get('chart_workers', 0),
+                       help='Render charts in a pool of N processes (0 renders in-process)')
+    parser.add_argument('--batch-size', type=int,
+                       default=CONFIG.get('history_batch_size', 100),
+                       help='Tickers per multi-symbol history download (0 disables batching)')
+    parser.add_argument('--no-cache', action='store_false', dest='use_cache',
+                       help='Ignore and do not update the local data cache')
+    parser.add_argument('--refresh', action='store_true',
+                       help='Re-download all data and overwrite the local cache')
+    parser.add_argument('--correlation', action='store_true',
+                       help='Write return correlation and covariance matrices for the given '
+                            'tickers, or every cached ticker, from cached history and exit')
+    parser.add_argument('--backtest', choices=list(BACKTEST_GRIDS),
+                       help='Backtest a strategy over cached history for the given tickers, '
+                            'or every cached ticker, and exit')
+    parser.add_argument('--grid', nargs='+', metavar='NAME=V1,V2',
+                       help='Backtest parameter values, e.g. fast=5,10,20 slow=100,200')
+    parser.add_argument('--commission-bps', type=float,
+                       help='Backtest commission per trade in basis points')
+    parser.add_argument('--slippage-bps', type=float,
+                       help='Backtest slippage per trade in basis points')
+    parser.add_argument('--portfolio', metavar='FILE',
+                       help='Analyze a portfolio from a CSV (ticker, weight or shares) or '
+                            'JSON (ticker: weight) file; with tickers, they are analyzed too')
+    parser.add_argument('--screen', metavar='EXPR',
+                       help='Filter the analyzed universe, e.g. "dist_52w_high_pct > -5 and '
+                            'volatility_pct < 30%%", and exit')
+    parser.add_argument('--rank', metavar='EXPR',
+                       help='Order screen results by an expression, highest first, and exit')
+    parser.add_argument('--ascending', action='store_true',
+                       help='Rank screen results lowest first')
+    parser.add_argument('--top', type=int, metavar='N', help='Keep the first N screen results')
+    replay_group = parser.add_mutually_exclusive_group()
+    replay_group.add_argument('--record', metavar='DIR',
+                       help='Save every downloaded response to DIR for later replay')
+    replay_group.add_argument('--replay', metavar='DIR',
+                       help='Replay recorded responses from DIR instead of contacting Yahoo')
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_args()
+    CONFIG['use_cache'] = CONFIG.get('use_cache', True) and args.use_cache
+    CONFIG['refresh'] = args.refresh
+    CONFIG['excel_engine'] = args.excel_engine
+    CONFIG['export_formats'] = args.formats
+    CONFIG['ticker_timeout'] = args.ticker_timeout
+    if args.excel_output:
+        CONFIG['excel_per_type'] = args.excel_output in ('both', 'per-type')
+        CONFIG['generate_summary'] = args.excel_output in ('both', 'summary')
+    if args.replay:
+        set_provider(ReplayProvider(args.replay))
+    elif args.record:
+        set_provider(RecordingProvider(get_provider(), args.record))
+    if args.replay or args.record:
+        # Recorded data must be complete and replayed data must neither fill
+        # nor be shadowed by the live cache
+        CONFIG['use_cache'] = False
+
+    if args.benchmark:
+        print(f"\n=== Benchmark: {args.benchmark} ===")
+        print(BENCHMARKS[args.benchmark]().to_string(index=False))
+        sys.exit(0)
+
+    if args.correlation:
+        try:
+            run_correlation(args.tickers, args.period, args.output)
+        except (ValueError, OSError, ImportError) as e:
+            logger.error("%s", str(e))
+            sys.exit(1)
+        sys.exit(0)
+
+    if args.backtest:
+        try:
+            run_backtest(args.tickers, args.period, args.output, args.backtest,
+                         parse_grid(args.grid), args.commission_bps, args.slippage_bps)
+        except (ValueError, KeyError, OSError, ImportError) as e:
+            logger.error("%s", str(e))
+            sys.exit(1)
+        sys.exit(0)
+
+    portfolio = None
+    if args.portfolio:
+        try:
+            portfolio = load_portfolio(args.portfolio)
+            if not args.tickers:
+                run_portfolio(portfolio, args.period, args.output, batch_size=args.batch_size,
+                              name=os.path.splitext(os.path.basename(args.portfolio))[0])
+                sys.exit(0)
+        except (ValueError, OSError, ImportError) as e:
+            logger.error("%s", str(e))
+            sys.exit(1)
+
+    if args.screen or args.rank:
+        try:
+            run_screen(args.screen, args.rank, args.top, args.ascending, args.output)
+        except (ValueError, OSError, ImportError) as e:
+            logger.error("%s", str(e))
+            sys.exit(1)
+        sys.exit(0)
 
     print("\n=== Stock Market Data Analyzer ===")
     print("This tool downloads and analyzes financial data for any publicly traded stock")
@@ -394,13 +3635,31 @@ if __name__ == "__main__":
     print("This may take a few minutes depending on the amount of data requested.")
     print("Downloading data, creating charts, and generating analysis...")
 
-    for ticker_idx, ticker_symbol in enumerate(args.tickers, 1):
+    if args.interval in INTRADAY_LIMITS:
+        available = INTRADAY_LIMITS[args.interval][1]
         try:
-            print(f"\n[{ticker_idx}/{len(args.tickers)}] Analyzing {ticker_symbol}...")
-            analyze_stock(ticker_symbol, args.period, args.output)
-        except (ValueError, TypeError, KeyError, OSError) as e:
-            print(f"✗ Error processing {ticker_symbol}: {str(e)}")
-            continue
+            start = period_start(args.period)
+        except ValueError:
+            start = None
+        if start is None or start < history_start(args.period, args.interval):
+            logger.info("%s bars are available for the last %d days only", args.interval,
+                        available)
+
+    # Holdings that are also analyzed share one daily history download
+    shared_histories = None
+    if portfolio is not None and args.interval == '1d':
+        shared_histories = fetch_histories(sorted(set(args.tickers) | set(portfolio[1].index)),
+                                           args.period, args.batch_size)
+    run_results = run_tickers(args.tickers, args.period, args.output,
+                              max(1, args.workers), args.batch_size, args.chart_workers,
+                              histories=shared_histories, interval=args.interval)
+    print_run_summary(run_results)
+    if portfolio is not None:
+        try:
+            run_portfolio(portfolio, args.period, args.output, shared_histories, args.batch_size,
+                          name=os.path.splitext(os.path.basename(args.portfolio))[0])
+        except (ValueError, OSError) as e:
+            logger.error("Portfolio analysis failed: %s", str(e))
 
     print("\n=== Analysis Complete! ===")
     print(f"Data has been saved to: {CONFIG['output_directory']}")